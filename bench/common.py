@@ -0,0 +1,71 @@
+"""Shared setup for the benchmarks: point engram at a scratch database and
+replace the embedding server with deterministic random unit vectors."""
+import hashlib
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+
+def fake_embedding(text: str) -> list[float]:
+    rng = random.Random(hashlib.sha256(text.encode()).digest())
+    vec = [rng.gauss(0, 1) for _ in range(main.EMBED_DIMS)]
+    norm = sum(x * x for x in vec) ** 0.5
+    return [x / norm for x in vec]
+
+
+def unit(vec: list[float]) -> list[float]:
+    norm = sum(x * x for x in vec) ** 0.5
+    return [x / norm for x in vec]
+
+
+def clustered(rng: random.Random, n: int, clusters: int, spread: float, weights: list[float] | None = None) -> list[list[float]]:
+    """n unit vectors drawn around random centroids, so that neighbours are close
+    enough for approximation error to matter. weights scales each dimension of
+    the centroids and the noise alike."""
+    dims = main.EMBED_DIMS
+    weights = weights or [1.0] * dims
+    centroids = [unit([rng.gauss(0, w) for w in weights]) for _ in range(clusters)]
+    noise = spread / dims ** 0.5
+    return [
+        unit([x + rng.gauss(0, noise * w) for x, w in zip(rng.choice(centroids), weights)])
+        for _ in range(n)
+    ]
+
+
+def load_vectors(collection: str, stored: list[list[float]]) -> None:
+    """Insert vectors as memories, bypassing the embedding step."""
+    first = main.memory_ids.reserve(len(stored))
+    rows = [(first + i, f"memory {i}", vec) for i, vec in enumerate(stored)]
+    main.writer.run(lambda db: main.insert_memories(db, collection, rows))
+
+
+def measure(search, queries: list[list[float]], truth: list[list[int]] | None, k: int) -> tuple[list[list[int]], float, float]:
+    """Run search(db, embedding, k) for each query: (results, recall@k against
+    truth, ms per query)."""
+    with main.db_pool.connection() as db:
+        start = time.perf_counter()
+        results = [search(db, query, k) for query in queries]
+        elapsed = time.perf_counter() - start
+    hits = sum(len(set(got) & set(want)) for got, want in zip(results, truth or results))
+    return results, hits / (len(queries) * k), elapsed / len(queries) * 1000
+
+
+def scratch_db() -> Path:
+    """Point the pool and writer at a fresh database and run migrations."""
+    path = Path(tempfile.mkdtemp(prefix="engram-bench-")) / "engram.db"
+    main.DB_PATH = main.db_pool.path = main.writer.path = path
+    main.get_embedding = main.query_embedding = fake_embedding
+    main.init_db()
+    return path
+
+
+def tool(name: str):
+    """The plain function behind an @mcp.tool()."""
+    fn = getattr(main, name)
+    return getattr(fn, "fn", fn)
@@ -0,0 +1,86 @@
+"""Fusion cost over long candidate lists: the old dict-and-sort RRF against fusion.fuse.
+
+    uv run bench/fusion.py [--sizes 1000,5000,20000] [--overlap 0.5] [--top-k 10] [--repeat 200]
+
+Each of the two legs returns `size` candidates, `overlap` of them shared with
+the other leg, with random distances and bm25 ranks. The NumPy RRF is checked
+to pick the same top-k as the dict version, and the score-based methods to
+rank a leg's lone hit above the candidates it didn't return.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fusion import fuse, leg  # noqa: E402
+
+
+def dict_rrf(rankings: list[list[int]], k: int = 60) -> list[tuple[int, float]]:
+    """reciprocal_rank_fusion as main.py had it before fusion.py."""
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0) + 1 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+
+def check_lone_hits() -> None:
+    """A leg with a single hit (or hits that all score the same) must still lift
+    them above the candidates it didn't return."""
+    vec = leg([1, 2, 3], [0.5, 0.6, 0.7])
+    got = fuse([vec, leg([3], [-5.0])], 3, method="minmax")
+    if got[0][0] != 3:
+        print(f"minmax: the only keyword hit, 3, ranked {[id for id, _ in got]}")
+    for method in ("minmax", "zscore"):
+        # 2 and 3 tie on the vector leg; only 3 matches the keywords
+        got = fuse([leg([1, 2, 3], [0.5, 0.6, 0.6]), leg([3], [-5.0])], 3, method=method)
+        if [id for id, _ in got].index(3) > [id for id, _ in got].index(2):
+            print(f"{method}: the only keyword hit, 3, ranked below 2: {[id for id, _ in got]}")
+
+
+def per_call_us(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,5000,20000")
+    parser.add_argument("--overlap", type=float, default=0.5)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    check_lone_hits()
+    rng = np.random.default_rng(0)
+    print(f"{'size':>6} {'dict rrf us':>12} {'rrf us':>8} {'minmax us':>10} {'zscore us':>10}   (per call)")
+    for size in (int(s) for s in args.sizes.split(",")):
+        shared = int(size * args.overlap)
+        pool = rng.permutation(size * 2 - shared) + 1
+        vec_ids = rng.permutation(pool[:size]).tolist()
+        fts_ids = rng.permutation(np.concatenate([pool[:shared], pool[size:]])).tolist()
+        distances = np.sort(rng.uniform(0.5, 1.5, size)).tolist()
+        ranks = np.sort(-rng.gamma(2.0, 3.0, size)).tolist()
+
+        old = dict_rrf([vec_ids, fts_ids])[:args.top_k]
+        new = fuse([leg(vec_ids), leg(fts_ids)], args.top_k)
+        if [id for id, _ in old] != [id for id, _ in new]:
+            print(f"size {size}: fusion.fuse picked a different top {args.top_k}")
+
+        timings = [per_call_us(lambda: dict_rrf([vec_ids, fts_ids])[:args.top_k], args.repeat)]
+        for method in ("rrf", "minmax", "zscore"):
+            # Building the arrays is part of every search, so it's timed too
+            timings.append(per_call_us(lambda: fuse(
+                [leg(vec_ids, distances), leg(fts_ids, ranks, 0.5)], args.top_k, method=method
+            ), args.repeat))
+        print(f"{size:>6} {timings[0]:>12.0f} {timings[1]:>8.0f} {timings[2]:>10.0f} {timings[3]:>10.0f}")
+
+
+if __name__ == "__main__":
+    main_()
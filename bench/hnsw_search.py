@@ -0,0 +1,72 @@
+"""HNSW against exact sqlite-vec search as a collection grows: recall and p50/p99 latency.
+
+    uv run --extra hnsw bench/hnsw_search.py [--sizes 10000,50000,200000] [--queries 200] [--k 50]
+
+Queries are noisy copies of stored vectors. Each size is added on top of the
+last, and the HNSW graph is grown incrementally the same way saves grow it.
+"""
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from common import clustered, load_vectors, main, scratch_db, unit
+
+import vectors
+
+
+def latencies(search, queries: list[list[float]], k: int) -> tuple[list[list[int]], list[float]]:
+    results, times = [], []
+    with main.db_pool.connection() as db:
+        for query in queries:
+            start = time.perf_counter()
+            results.append(search(db, query, k))
+            times.append((time.perf_counter() - start) * 1000)
+    return results, sorted(times)
+
+
+def percentile(times: list[float], p: float) -> float:
+    return times[min(len(times) - 1, int(len(times) * p))]
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,50000,200000")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    scratch_db()
+    index = vectors.HnswIndex(main.EMBED_DIMS, Path(tempfile.mkdtemp()), metrics=main.metrics)
+    print(f"{'memories':>10} {'exact p50':>10} {'exact p99':>10} {'hnsw p50':>10} {'hnsw p99':>10} {'recall@' + str(args.k):>10} {'build s':>8}")
+    have = 0
+    stored: list[list[float]] = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        batch = clustered(rng, size - have, max((size - have) // 50, 1), spread=0.5)
+        load_vectors("bench", batch)
+        stored += batch
+        have = size
+        start = time.perf_counter()
+        added = main.writer.run(index.sync)
+        build = time.perf_counter() - start
+        assert added == len(batch), (added, len(batch))
+
+        queries = [
+            unit([x + rng.gauss(0, 0.2 / main.EMBED_DIMS ** 0.5) for x in rng.choice(stored)])
+            for _ in range(args.queries)
+        ]
+        truth, exact = latencies(lambda db, q, k: main.exact_index.search(db, "bench", q, k), queries, args.k)
+        got, hnsw = latencies(lambda db, q, k: index.search(db, "bench", q, k), queries, args.k)
+        recall = sum(len(set(a) & set(b)) for a, b in zip(got, truth)) / (len(queries) * args.k)
+        print(
+            f"{size:>10} {percentile(exact, 0.5):>10.2f} {percentile(exact, 0.99):>10.2f}"
+            f" {percentile(hnsw, 0.5):>10.2f} {percentile(hnsw, 0.99):>10.2f} {recall:>10.3f} {build:>8.1f}"
+        )
+    main.writer.close()
+    main.db_pool.close()
+
+
+if __name__ == "__main__":
+    main_()
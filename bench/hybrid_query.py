@@ -0,0 +1,68 @@
+"""search_memory latency: separate queries with fusion in Python, against one SQL statement.
+
+    uv run bench/hybrid_query.py [--size 20000] [--queries 200] [--top-k 5] [--embed-ms 0,20]
+
+Memories are random word salads, so keyword matches are spread across the
+collection. --embed-ms adds a fake embeddings-server delay: the multi-query
+path runs the keyword leg during it, the single statement can't. Both paths
+are checked to return the same results.
+"""
+import argparse
+import random
+import time
+
+from common import fake_embedding, main, scratch_db
+
+WORDS = [f"w{i}" for i in range(2000)]
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--embed-ms", default="0,20")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    scratch_db()
+    texts = [" ".join(rng.choices(WORDS, k=30)) for _ in range(args.size)]
+    first = main.memory_ids.reserve(len(texts))
+    rows = [(first + i, text, fake_embedding(text)) for i, text in enumerate(texts)]
+    main.writer.run(lambda db: main.insert_memories(db, "bench", rows))
+    # A second collection, so the keyword leg has postings to skip
+    main.writer.run(lambda db: main.insert_memories(db, "other", [
+        (main.memory_ids.reserve(), text, fake_embedding(text)) for text in texts[:args.size // 4]
+    ]))
+    queries = [" OR ".join(rng.sample(WORDS, 2)) for _ in range(args.queries)]
+    depth = args.top_k * main.SEARCH_CANDIDATES
+
+    print(f"{'embed ms':>8} {'steps ms':>10} {'one query ms':>13}   (per search)")
+    for embed_ms in (float(s) for s in args.embed_ms.split(",")):
+        def embed(text: str) -> list[float]:
+            time.sleep(embed_ms / 1000)
+            return fake_embedding(text)
+        main.query_embedding = embed
+
+        timings = {}
+        results = {}
+        for name, search in (("steps", main.search_in_steps), ("one", main.search_in_one_query)):
+            start = time.perf_counter()
+            results[name] = [
+                search("bench", q, depth, args.size, args.top_k, "rrf", (1.0, 1.0)) for q in queries
+            ]
+            timings[name] = (time.perf_counter() - start) / len(queries) * 1000
+        mismatches = sum(
+            [(id, round(score, 9)) for id, _, _, score in a] != [(id, round(score, 9)) for id, _, _, score in b]
+            for a, b in zip(results["steps"], results["one"])
+        )
+        if mismatches:
+            print(f"{mismatches} searches returned different results")
+        print(f"{embed_ms:>8.0f} {timings['steps']:>10.2f} {timings['one']:>13.2f}")
+    main.search_executor.shutdown()
+    main.writer.close()
+    main.db_pool.close()
+
+
+if __name__ == "__main__":
+    main_()
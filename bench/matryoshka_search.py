@@ -0,0 +1,52 @@
+"""Recall and latency of truncated-dimension (matryoshka) search against full-dim search.
+
+    uv run bench/matryoshka_search.py [--size 10000] [--queries 100] [--k 10] [--dims 64,128,256,512] [--oversample 4,8,16]
+
+Synthetic vectors only imitate a matryoshka model: the variance of each
+dimension decays along the vector, so a prefix carries most of the signal.
+Real embeddings will do better or worse depending on the model, so use this
+for the latency side and check recall on a copy of your own data.
+"""
+import argparse
+import random
+
+from common import clustered, load_vectors, main, measure, scratch_db, unit
+
+import vectors
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dims", default="64,128,256,512")
+    parser.add_argument("--oversample", default="4,8,16")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    scratch_db()
+    print(f"generating {args.size} vectors...")
+    weights = [(1 + i / 64) ** -0.5 for i in range(main.EMBED_DIMS)]
+    stored = clustered(rng, args.size, max(args.size // 50, 1), spread=0.5, weights=weights)
+    load_vectors("bench", stored)
+    queries = [
+        unit([x + rng.gauss(0, 0.2 * w / main.EMBED_DIMS ** 0.5) for x, w in zip(rng.choice(stored), weights)])
+        for _ in range(args.queries)
+    ]
+    truth, _, exact_ms = measure(lambda db, q, k: main.exact_index.search(db, "bench", q, k), queries, None, args.k)
+
+    print(f"{'dims':>6} {'oversample':>10} {'recall@' + str(args.k):>10} {'ms/query':>10}")
+    print(f"{main.EMBED_DIMS:>6} {'-':>10} {1.0:>10.3f} {exact_ms:>10.2f}")
+    for dims in (int(s) for s in args.dims.split(",")):
+        for oversample in (int(s) for s in args.oversample.split(",")):
+            index = vectors.TruncatedIndex(dims, oversample=oversample, metrics=main.metrics)
+            main.writer.run(index.sync)
+            _, recall, ms = measure(lambda db, q, k: index.search(db, "bench", q, k), queries, truth, args.k)
+            print(f"{dims:>6} {oversample:>10} {recall:>10.3f} {ms:>10.2f}")
+    main.writer.close()
+    main.db_pool.close()
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,68 @@
+"""Per-collection recall and latency of PCA-reduced search against exact search.
+
+    uv run bench/pca_search.py [--size 10000] [--queries 100] [--k 10] [--dims 128] [--oversample 4]
+
+Each synthetic collection lives near its own random subspace, of 32 to 512
+dimensions plus isotropic noise, so the benefit of a per-collection
+projection depends on how well PCA_DIMS covers it. Queries are noisy copies
+of stored vectors.
+"""
+import argparse
+import random
+
+import numpy as np
+
+from common import load_vectors, main, measure, scratch_db
+
+import vectors
+
+SUBSPACES = (32, 128, 512)
+
+
+def subspace_vectors(rng: np.random.Generator, n: int, rank: int, noise: float) -> np.ndarray:
+    dims = main.EMBED_DIMS
+    basis = rng.normal(size=(rank, dims)) / rank ** 0.5
+    x = rng.normal(size=(n, rank)) @ basis + rng.normal(scale=noise / dims ** 0.5, size=(n, dims))
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=10000, help="vectors per collection")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dims", type=int, default=128)
+    parser.add_argument("--oversample", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    pick = random.Random(0)
+    scratch_db()
+    stored = {}
+    for rank in SUBSPACES:
+        stored[f"rank-{rank}"] = subspace_vectors(rng, args.size, rank, noise=0.3)
+        load_vectors(f"rank-{rank}", stored[f"rank-{rank}"].tolist())
+
+    index = vectors.PcaIndex(
+        args.dims, oversample=args.oversample, min_fit=1, refit_growth=2.0, fit_sample=10000,
+        recall_sample=0.0, read=main.db_pool.connection, write=main.writer.submit, metrics=main.metrics,
+    )
+    main.writer.run(index.sync)
+
+    print(f"{'collection':>12} {'explained':>10} {'exact ms':>9} {'pca ms':>9} {'recall@' + str(args.k):>10}")
+    for collection, vecs in stored.items():
+        queries = []
+        for _ in range(args.queries):
+            v = vecs[pick.randrange(len(vecs))] + rng.normal(scale=0.1 / main.EMBED_DIMS ** 0.5, size=main.EMBED_DIMS)
+            queries.append((v / np.linalg.norm(v)).tolist())
+        truth, _, exact_ms = measure(lambda db, q, k: main.exact_index.search(db, collection, q, k), queries, None, args.k)
+        _, recall, pca_ms = measure(lambda db, q, k: index.search(db, collection, q, k), queries, truth, args.k)
+        explained = index.projection(collection).explained
+        print(f"{collection:>12} {explained:>10.3f} {exact_ms:>9.2f} {pca_ms:>9.2f} {recall:>10.3f}")
+    index.persist()
+    main.writer.close()
+    main.db_pool.close()
+
+
+if __name__ == "__main__":
+    main_()
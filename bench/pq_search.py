@@ -0,0 +1,58 @@
+"""Recall, latency and memory of product-quantized search against exact search.
+
+    uv run bench/pq_search.py [--size 20000] [--queries 100] [--k 10] [--subvectors 64,128,256] [--rerank 0,4]
+
+Queries are noisy copies of stored vectors. Training time covers the k-means
+codebooks plus coding every vector; the first search of each configuration,
+which loads the codes into memory, is left out of ms/query.
+"""
+import argparse
+import random
+import time
+
+from common import clustered, load_vectors, main, measure, scratch_db, unit
+
+import vectors
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--subvectors", default="64,128,256")
+    parser.add_argument("--rerank", default="0,4")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    scratch_db()
+    print(f"generating {args.size} vectors...")
+    stored = clustered(rng, args.size, max(args.size // 50, 1), spread=0.5)
+    load_vectors("bench", stored)
+    queries = [
+        unit([x + rng.gauss(0, 0.2 / main.EMBED_DIMS ** 0.5) for x in rng.choice(stored)])
+        for _ in range(args.queries)
+    ]
+    truth, _, exact_ms = measure(lambda db, q, k: main.exact_index.search(db, "bench", q, k), queries, None, args.k)
+
+    print(f"{'subvectors':>10} {'rerank':>6} {'bytes/vec':>10} {'train s':>8} {'recall@' + str(args.k):>10} {'ms/query':>10}")
+    print(f"{'exact':>10} {'-':>6} {main.EMBED_DIMS * 4:>10} {'-':>8} {1.0:>10.3f} {exact_ms:>10.2f}")
+    for subvectors in (int(s) for s in args.subvectors.split(",")):
+        trained = None
+        for rerank in (int(s) for s in args.rerank.split(",")):
+            index = vectors.PqIndex(
+                main.EMBED_DIMS, subvectors=subvectors, per_collection=False, rerank=rerank,
+                train_sample=20000, min_train=1, max_bytes=2 ** 40, metrics=main.metrics,
+            )
+            start = time.perf_counter()
+            main.writer.run(index.sync)
+            trained = trained or time.perf_counter() - start
+            measure(lambda db, q, k: index.search(db, "bench", q, k), queries[:1], None, args.k)
+            _, recall, ms = measure(lambda db, q, k: index.search(db, "bench", q, k), queries, truth, args.k)
+            print(f"{subvectors:>10} {rerank:>6} {subvectors:>10} {trained:>8.1f} {recall:>10.3f} {ms:>10.2f}")
+    main.writer.close()
+    main.db_pool.close()
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,48 @@
+"""Recall and latency of the quantized vector indexes against exact search.
+
+    uv run bench/quantized_search.py [--size 10000] [--queries 100] [--k 10] [--oversample 4,8,16]
+
+Queries are noisy copies of stored vectors. Recall@k is the share of the
+exact top k that each index returns.
+"""
+import argparse
+import random
+
+from common import clustered, load_vectors, main, measure, scratch_db, unit
+
+import vectors
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--oversample", default="4,8,16")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    scratch_db()
+    print(f"generating {args.size} vectors...")
+    stored = clustered(rng, args.size, max(args.size // 50, 1), spread=0.5)
+    load_vectors("bench", stored)
+    queries = [
+        unit([x + rng.gauss(0, 0.2 / main.EMBED_DIMS ** 0.5) for x in rng.choice(stored)])
+        for _ in range(args.queries)
+    ]
+    truth, _, exact_ms = measure(lambda db, q, k: main.exact_index.search(db, "bench", q, k), queries, None, args.k)
+
+    print(f"{'index':>8} {'oversample':>10} {'bytes/vec':>10} {'recall@' + str(args.k):>10} {'ms/query':>10}")
+    print(f"{'exact':>8} {'-':>10} {main.EMBED_DIMS * 4:>10} {1.0:>10.3f} {exact_ms:>10.2f}")
+    for kind in ("bit", "int8"):
+        for oversample in (int(s) for s in args.oversample.split(",")):
+            index = vectors.QuantizedIndex(kind, main.EMBED_DIMS, oversample=oversample, metrics=main.metrics)
+            main.writer.run(index.sync)
+            _, recall, ms = measure(lambda db, q, k: index.search(db, "bench", q, k), queries, truth, args.k)
+            print(f"{kind:>8} {oversample:>10} {index.bytes_per_vector:>10} {recall:>10.3f} {ms:>10.2f}")
+    main.writer.close()
+    main.db_pool.close()
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,91 @@
+"""Check that the hot read queries are answered from indexes.
+
+    uv run bench/query_plans.py
+
+Runs the real sampling and listing code against a scratch database, records
+every SELECT it executes, and prints EXPLAIN QUERY PLAN for each. Exits
+non-zero if any of them scans memories without an index or sorts rows
+through a temporary B-tree. list_collections reads the small collections
+table and sorts that, which is expected.
+"""
+import re
+import sys
+from datetime import timedelta
+
+from common import fake_embedding, main, scratch_db
+
+# name -> (code path run against a connection, temp B-tree uses that are expected)
+CASES = {
+    "randomly_remember(age='any'), no holes": (lambda db: main.sample_memories(db, "notes", 3), []),
+    "randomly_remember(age='any'), with holes": (lambda db: main.sample_memories(db, "holes", 3), []),
+    "randomly_remember(age='recent')": (
+        lambda db: main.sample_by_age(db, "notes", 3, timedelta(days=30), newest=True), []
+    ),
+    "randomly_remember(age='old')": (
+        lambda db: main.sample_by_age(db, "notes", 3, timedelta(days=30), newest=False), []
+    ),
+    "list_collections()": (main.collection_stats, ["USE TEMP B-TREE FOR ORDER BY"]),
+}
+
+
+def shape(sql: str) -> str:
+    """sql with its literals blanked out, so repeated draws count once."""
+    return " ".join(re.sub(r"'[^']*'|\b\d+\b", "?", sql).split())
+
+
+def executed_selects(db, run) -> list[str]:
+    """The SELECT statements run(db) executes, parameters filled in, one per shape."""
+    statements: list[str] = []
+    db.set_trace_callback(statements.append)
+    try:
+        run(db)
+    finally:
+        db.set_trace_callback(None)
+    selects: dict[str, str] = {}
+    for sql in statements:
+        if sql.lstrip().upper().startswith("SELECT"):
+            selects.setdefault(shape(sql), sql)
+    return list(selects.values())
+
+
+def problems(plan: list[str], expected: list[str]) -> list[str]:
+    found = []
+    for detail in plan:
+        if "TEMP B-TREE" in detail and detail not in expected:
+            found.append(detail)
+        if detail.startswith("SCAN memories") and "INDEX" not in detail:
+            found.append(detail)
+    return found
+
+
+def main_() -> int:
+    scratch_db()
+    for collection in ("notes", "holes"):
+        texts = [f"{collection} {i}" for i in range(20)]
+        first = main.memory_ids.reserve(len(texts))
+        rows = [(first + i, text, fake_embedding(text)) for i, text in enumerate(texts)]
+        main.writer.run(lambda db: main.insert_memories(db, collection, rows))
+    # Leave gaps in the seq numbers, so sampling takes its seek-per-draw path
+    main.writer.run(lambda db: db.execute("DELETE FROM memories WHERE collection = 'holes' AND seq % 3 = 0"))
+
+    failed = False
+    with main.db_pool.connection() as db:
+        for name, (run, expected) in CASES.items():
+            statements = executed_selects(db, run)
+            if not statements:
+                print(f"FAIL {name}: ran no queries")
+                failed = True
+            for sql in statements:
+                plan = [row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {sql}")]
+                bad = problems(plan, expected)
+                failed |= bool(bad)
+                print(f"{'FAIL' if bad else 'ok  '} {name}: {shape(sql)[:90]}")
+                for detail in plan:
+                    print(f"       {detail}")
+    main.writer.close()
+    main.db_pool.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_())
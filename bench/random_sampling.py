@@ -0,0 +1,61 @@
+"""randomly_remember(age='any') latency as a collection grows.
+
+    uv run bench/random_sampling.py [--sizes 1000,10000,100000] [--draws 200]
+
+Compares seq-based sampling (sample_memories) against the ORDER BY RANDOM()
+query it replaced. Rows go straight into memories, without vectors, since
+only the memories table is involved.
+"""
+import argparse
+import time
+
+from common import main, scratch_db
+
+
+def grow(collection: str, target: int) -> None:
+    def insert(db):
+        have = db.execute(
+            "SELECT COALESCE(MAX(memory_count), 0) FROM collections WHERE name = ?", [collection]
+        ).fetchone()[0]
+        db.executemany(
+            "INSERT INTO memories(collection, text) VALUES (?, ?)",
+            [(collection, f"memory {i} " + "lorem ipsum " * 20) for i in range(have, target)]
+        )
+    main.writer.run(insert)
+
+
+def time_per_draw(fn, draws: int) -> float:
+    start = time.perf_counter()
+    for _ in range(draws):
+        fn()
+    return (time.perf_counter() - start) / draws * 1000
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--draws", type=int, default=200)
+    args = parser.parse_args()
+
+    scratch_db()
+    print(f"{'memories':>10} {'seq sample':>12} {'sample n=10':>12} {'ORDER BY RANDOM()':>18}   (ms per call)")
+    for size in (int(s) for s in args.sizes.split(",")):
+        grow("bench", size)
+        # Another collection of the same size, so "bench" is only half the table
+        grow("other", size)
+        with main.db_pool.connection() as db:
+            sampled = time_per_draw(lambda: main.sample_memories(db, "bench", 1), args.draws)
+            sampled_10 = time_per_draw(lambda: main.sample_memories(db, "bench", 10), args.draws)
+            ordered = time_per_draw(lambda: db.execute("""
+                SELECT id, text, created_at FROM memories
+                WHERE collection = ?
+                ORDER BY RANDOM()
+                LIMIT 1
+            """, ["bench"]).fetchall(), max(args.draws // 10, 1))
+        print(f"{size:>10} {sampled:>12.3f} {sampled_10:>12.3f} {ordered:>18.3f}")
+    main.writer.close()
+    main.db_pool.close()
+
+
+if __name__ == "__main__":
+    main_()
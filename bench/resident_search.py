@@ -0,0 +1,51 @@
+"""Exact vector search latency: sqlite-vec against the resident NumPy matrices.
+
+    uv run bench/resident_search.py [--sizes 1000,10000,50000] [--queries 100] [--k 50]
+
+Both are exact, so only latency is compared (and the results checked equal).
+The first resident search of a collection loads it from memory_vecs; that
+load is timed separately.
+"""
+import argparse
+import random
+import time
+
+from common import load_vectors, main, measure, scratch_db, unit
+
+import vectors
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    scratch_db()
+    print(f"{'memories':>10} {'sqlite-vec':>12} {'numpy':>12} {'first load':>12}   (ms)")
+    have = 0
+    for size in (int(s) for s in args.sizes.split(",")):
+        load_vectors("bench", [
+            unit([rng.gauss(0, 1) for _ in range(main.EMBED_DIMS)]) for _ in range(size - have)
+        ])
+        have = size
+        queries = [unit([rng.gauss(0, 1) for _ in range(main.EMBED_DIMS)]) for _ in range(args.queries)]
+        truth, _, sqlite_ms = measure(lambda db, q, k: main.exact_index.search(db, "bench", q, k), queries, None, args.k)
+
+        index = vectors.ResidentIndex(main.EMBED_DIMS, max_bytes=2 ** 40, metrics=main.metrics)
+        with main.db_pool.connection() as db:
+            start = time.perf_counter()
+            index.search(db, "bench", queries[0], args.k)
+            load_ms = (time.perf_counter() - start) * 1000
+        _, recall, numpy_ms = measure(lambda db, q, k: index.search(db, "bench", q, k), queries, truth, args.k)
+        if recall < 1.0:
+            print(f"results differ from sqlite-vec: recall {recall:.3f}")
+        print(f"{size:>10} {sqlite_ms:>12.2f} {numpy_ms:>12.2f} {load_ms:>12.1f}")
+    main.writer.close()
+    main.db_pool.close()
+
+
+if __name__ == "__main__":
+    main_()
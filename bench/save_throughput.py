@@ -0,0 +1,57 @@
+"""Saves/sec with and without group commit.
+
+    uv run bench/save_throughput.py [--saves 2000] [--threads 8]
+
+Modes: every save in its own transaction; concurrent saves sharing a commit
+(the default); and write-behind, where saves return once queued.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import fake_embedding, main, scratch_db, tool
+
+MODES = [
+    # label, batch_max_items, write_behind
+    ("commit per save", 1, False),
+    ("group commit", main.GROUP_COMMIT_MAX_ITEMS, False),
+    ("write-behind", main.GROUP_COMMIT_MAX_ITEMS, True),
+]
+
+
+def run(texts: list[str], threads: int, batch_max_items: int, write_behind: bool) -> tuple[float, int]:
+    main.writer.batch_max_items = batch_max_items
+    main.WRITE_BEHIND = write_behind
+    save_memory = tool("save_memory")
+    commits_before = main.metrics.snapshot()["counters"].get("writer.commits", 0)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda text: save_memory("bench", text), texts))
+    main.writer.flush()
+    elapsed = time.perf_counter() - start
+    commits = main.metrics.snapshot()["counters"]["writer.commits"] - commits_before
+    return len(texts) / elapsed, commits
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--saves", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    scratch_db()
+    # Precompute vectors so the timing covers the write path only
+    texts = [f"benchmark memory {i}" for i in range(args.saves)]
+    vectors = {text: fake_embedding(text) for text in texts}
+    main.get_embedding = vectors.__getitem__
+
+    print(f"{args.saves} saves, {args.threads} threads")
+    for label, batch_max_items, write_behind in MODES:
+        rate, commits = run(texts, args.threads, batch_max_items, write_behind)
+        print(f"  {label:16} {rate:10.0f} saves/sec  ({commits} commits)")
+    main.writer.close()
+    main.db_pool.close()
+
+
+if __name__ == "__main__":
+    main_()
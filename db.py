@@ -0,0 +1,421 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from metrics import Metrics
+
+log = logging.getLogger("engram.db")
+
+
+def connect(
+    path: Path,
+    init: Callable[[sqlite3.Connection], None],
+    *,
+    cached_statements: int = 128,
+    isolation_level: str | None = "",
+) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(
+        path,
+        check_same_thread=False,
+        cached_statements=cached_statements,
+        isolation_level=isolation_level,
+    )
+    try:
+        init(db)
+    except Exception:
+        db.close()
+        raise
+    return db
+
+
+def is_busy(e: sqlite3.OperationalError) -> bool:
+    # Mask off extended result codes (e.g. SQLITE_BUSY_SNAPSHOT)
+    return (getattr(e, "sqlite_errorcode", 0) & 0xFF) in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+class ConnectionPool:
+    """A bounded pool of initialized SQLite connections shared across threads.
+
+    Connections are created lazily, handed out LIFO so the most recently used
+    (and warmest) connection is reused first, and closed by a reaper thread
+    once they've been idle for longer than `idle_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        size: int,
+        idle_timeout: float,
+        init: Callable[[sqlite3.Connection], None],
+        metrics: Metrics,
+        name: str = "pool",
+        cached_statements: int = 128,
+    ):
+        self.path = path
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.name = name
+        self._init = init
+        self._metrics = metrics
+        self._cached_statements = cached_statements
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle: list[tuple[sqlite3.Connection, float]] = []
+        self._closed = False
+        self._reaper: threading.Thread | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        db = connect(self.path, self._init, cached_statements=self._cached_statements)
+        self._metrics.incr(f"{self.name}.opened")
+        return db
+
+    def _close(self, db: sqlite3.Connection, reason: str) -> None:
+        db.close()
+        self._metrics.incr(f"{self.name}.{reason}")
+
+    @contextmanager
+    def connection(self):
+        if self._closed:
+            raise RuntimeError(f"Connection pool '{self.name}' is closed")
+        self._start_reaper()
+
+        start = time.perf_counter()
+        self._slots.acquire()
+        self._metrics.observe(f"{self.name}.wait", time.perf_counter() - start)
+
+        try:
+            with self._lock:
+                db = self._idle.pop()[0] if self._idle else None
+            if db is None:
+                db = self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+        try:
+            yield db
+        except sqlite3.OperationalError as e:
+            if is_busy(e):
+                self._metrics.incr(f"{self.name}.busy")
+            raise
+        finally:
+            # Never hand a connection back with an open transaction
+            if db.in_transaction:
+                db.rollback()
+            with self._lock:
+                if self._closed:
+                    self._close(db, "closed")
+                else:
+                    self._idle.append((db, time.monotonic()))
+            self._slots.release()
+
+    def _start_reaper(self) -> None:
+        if self._reaper is not None:
+            return
+        with self._lock:
+            if self._reaper is None:
+                self._reaper = threading.Thread(
+                    target=self._reap_loop, name=f"{self.name}-reaper", daemon=True
+                )
+                self._reaper.start()
+
+    def _reap_loop(self) -> None:
+        while not self._closed:
+            time.sleep(max(self.idle_timeout / 2, 1.0))
+            self.reap()
+
+    def reap(self) -> None:
+        """Close connections that have been idle for longer than idle_timeout."""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            # _idle is ordered oldest-first, so stale connections are a prefix
+            stale = 0
+            while stale < len(self._idle) and self._idle[stale][1] < cutoff:
+                stale += 1
+            expired, self._idle = self._idle[:stale], self._idle[stale:]
+        for db, _ in expired:
+            self._close(db, "reaped")
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for db, _ in idle:
+            self._close(db, "closed")
+
+
+class _Job(NamedTuple):
+    fn: Callable[[sqlite3.Connection], Any]
+    transaction: bool
+    deferred: bool
+    future: Future
+    enqueued: float
+
+
+class Writer:
+    """Serializes every write through one connection owned by a dedicated thread.
+
+    Jobs are callables taking the write connection; each job's return value
+    (or exception) is delivered through the Future returned by submit().
+
+    Transactional jobs are group-committed: whatever is already queued when
+    the writer picks up a job (up to `batch_max_items`) runs in the same
+    BEGIN IMMEDIATE ... COMMIT, each job inside its own savepoint so one
+    failure doesn't take the others down. Nobody's future resolves before
+    the shared COMMIT. A batch that contains only `deferred` jobs (nobody is
+    waiting on them) additionally waits up to `batch_window` seconds for more
+    work before committing.
+
+    While the queue is idle the thread also runs WAL checkpoints every
+    `checkpoint_interval` seconds, if anything was written since the last one.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        init: Callable[[sqlite3.Connection], None],
+        metrics: Metrics,
+        checkpoint_interval: float = 30.0,
+        checkpoint_mode: str = "PASSIVE",
+        batch_window: float = 0.05,
+        batch_max_items: int = 256,
+        busy_retries: int = 5,
+        name: str = "writer",
+    ):
+        if checkpoint_mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"Unknown WAL checkpoint mode: {checkpoint_mode}")
+        self.path = path
+        self.name = name
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_mode = checkpoint_mode
+        self.batch_window = batch_window
+        self.batch_max_items = batch_max_items
+        self.busy_retries = busy_retries
+        self._init = init
+        self._metrics = metrics
+        self._queue: queue.Queue[_Job | None] = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._closed = False
+        self._dirty = False
+
+    def submit(
+        self,
+        fn: Callable[[sqlite3.Connection], Any],
+        *,
+        transaction: bool = True,
+        deferred: bool = False,
+    ) -> Future:
+        """Queue a write. `deferred` jobs may wait up to batch_window to share a commit."""
+        self._start()
+        future: Future = Future()
+        if deferred:
+            future.add_done_callback(self._report_deferred_failure)
+        # Under the lock, so the job can't land behind the stop marker close() queues
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"Writer '{self.name}' is closed")
+            self._queue.put(_Job(fn, transaction, deferred, future, time.perf_counter()))
+        return future
+
+    def run(self, fn: Callable[[sqlite3.Connection], Any], *, transaction: bool = True) -> Any:
+        return self.submit(fn, transaction=transaction).result()
+
+    def flush(self) -> None:
+        """Block until every job queued so far has been committed."""
+        self.run(lambda db: None)
+
+    def _report_deferred_failure(self, future: Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            self._metrics.incr(f"{self.name}.deferred_failed")
+            log.error("Deferred write failed", exc_info=future.exception())
+
+    def _start(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"Writer '{self.name}' is closed")
+            if self._thread is None:
+                # Connect before the thread starts so setup errors surface to the caller
+                db = connect(self.path, self._init, isolation_level=None)
+                self._metrics.incr(f"{self.name}.opened")
+                self._thread = threading.Thread(
+                    target=self._loop, args=(db,), name=self.name, daemon=True
+                )
+                self._thread.start()
+
+    def _loop(self, db: sqlite3.Connection) -> None:
+        timeout = self.checkpoint_interval if self.checkpoint_interval > 0 else None
+        pending: _Job | None = None
+        stopping = False
+        try:
+            while not stopping or pending is not None:
+                if pending is not None:
+                    job, pending = pending, None
+                else:
+                    try:
+                        job = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        if self._dirty:
+                            self._checkpoint(db)
+                        continue
+                    if job is None:
+                        break
+                if not job.transaction:
+                    self._run_one(db, job)
+                    continue
+                batch, pending, stopping = self._collect(job)
+                self._run_batch(db, batch)
+            if self._dirty:
+                self._checkpoint(db)
+        finally:
+            db.close()
+
+    def _collect(self, first: _Job) -> tuple[list[_Job], _Job | None, bool]:
+        """Gather queued transactional jobs to commit together with `first`.
+
+        Returns the batch, a non-transactional job that has to run on its own
+        afterwards (if one was dequeued), and whether shutdown was requested.
+        """
+        batch = [first]
+        deadline = first.enqueued + self.batch_window if first.deferred else None
+        while len(batch) < self.batch_max_items:
+            try:
+                if deadline is None:
+                    job = self._queue.get_nowait()
+                else:
+                    job = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            if job is None:
+                return batch, None, True
+            if not job.transaction:
+                return batch, job, False
+            batch.append(job)
+            if not job.deferred:
+                # Someone is waiting on this batch: commit as soon as the queue is drained
+                deadline = None
+        return batch, None, False
+
+    def _run_one(self, db: sqlite3.Connection, job: _Job) -> None:
+        self._metrics.observe(f"{self.name}.queue_wait", time.perf_counter() - job.enqueued)
+        if not job.future.set_running_or_notify_cancel():
+            return
+        self._dirty = True
+        try:
+            result = job.fn(db)
+        except BaseException as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+
+    def _run_batch(self, db: sqlite3.Connection, batch: list[_Job]) -> None:
+        now = time.perf_counter()
+        jobs = []
+        for job in batch:
+            self._metrics.observe(f"{self.name}.queue_wait", now - job.enqueued)
+            if job.future.set_running_or_notify_cancel():
+                jobs.append(job)
+        if not jobs:
+            return
+        self._dirty = True
+        outcomes: list[tuple[bool, Any]] = []
+        try:
+            with self._metrics.timer(f"{self.name}.commit"):
+                self._begin(db)
+                try:
+                    for job in jobs:
+                        db.execute("SAVEPOINT job")
+                        try:
+                            outcomes.append((True, job.fn(db)))
+                        except Exception as e:
+                            db.execute("ROLLBACK TO job")
+                            outcomes.append((False, e))
+                        db.execute("RELEASE job")
+                    db.execute("COMMIT")
+                except BaseException:
+                    if db.in_transaction:
+                        db.execute("ROLLBACK")
+                    raise
+        except BaseException as e:
+            if isinstance(e, sqlite3.OperationalError) and is_busy(e):
+                self._metrics.incr(f"{self.name}.busy")
+            for job in jobs:
+                job.future.set_exception(e)
+            return
+        self._metrics.incr(f"{self.name}.commits")
+        self._metrics.incr(f"{self.name}.jobs", len(jobs))
+        for job, (ok, value) in zip(jobs, outcomes):
+            if ok:
+                job.future.set_result(value)
+            else:
+                job.future.set_exception(value)
+
+    def _begin(self, db: sqlite3.Connection) -> None:
+        for attempt in range(self.busy_retries + 1):
+            try:
+                # Takes the write lock up front; waits up to busy_timeout for
+                # writers in other processes before raising
+                db.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if not is_busy(e) or attempt == self.busy_retries:
+                    raise
+                self._metrics.incr(f"{self.name}.busy")
+                time.sleep(0.05 * 2 ** attempt)
+
+    def _checkpoint(self, db: sqlite3.Connection) -> None:
+        with self._metrics.timer(f"{self.name}.checkpoint"):
+            busy, _, _ = db.execute(f"PRAGMA wal_checkpoint({self.checkpoint_mode})").fetchone()
+        self._metrics.incr(f"{self.name}.checkpoints")
+        if busy:
+            # Readers were still using older snapshots; retry on the next idle tick
+            self._metrics.incr(f"{self.name}.checkpoint_busy")
+        else:
+            self._dirty = False
+
+    def close(self) -> None:
+        """Commit everything still queued, checkpoint, and close the write connection."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+
+class IdAllocator:
+    """Hands out increasing row ids before their INSERT runs.
+
+    Lets a queued write be acknowledged with its final id. Assumes this
+    process is the only writer of the table; `load` returns the highest id
+    already used and is called once, on first reservation.
+    """
+
+    def __init__(self, load: Callable[[], int]):
+        self._load = load
+        self._lock = threading.Lock()
+        self._last: int | None = None
+
+    def reserve(self, n: int = 1) -> int:
+        """Reserve n consecutive ids and return the first."""
+        with self._lock:
+            if self._last is None:
+                self._last = self._load()
+            first = self._last + 1
+            self._last += n
+            return first
@@ -0,0 +1,195 @@
+import hashlib
+import http.client
+import json
+import threading
+import time
+import unicodedata
+import urllib.parse
+from collections import OrderedDict
+from collections.abc import Callable
+
+from metrics import Metrics
+
+
+def text_hash(text: str) -> bytes:
+    """sha256 of the text after Unicode NFC normalization and trimming."""
+    return hashlib.sha256(unicodedata.normalize("NFC", text).strip().encode()).digest()
+
+
+class EmbeddingCache:
+    """Two-tier cache of float32 embedding blobs keyed by (model, text hash).
+
+    The first tier is an in-process LRU bounded by the total size of the
+    blobs it holds. The optional second tier is persistent: `load` is asked
+    on a first-tier miss and `store` is given the freshly computed embeddings
+    put with `persist`. A second-tier hit is promoted into the first tier.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_bytes: int,
+        metrics: Metrics,
+        load: Callable[[str, bytes], bytes | None] | None = None,
+        store: Callable[[str, bytes, bytes], None] | None = None,
+        name: str = "embed_cache",
+    ):
+        self.max_bytes = max_bytes
+        self.name = name
+        self._metrics = metrics
+        self._load = load
+        self._store = store
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[str, bytes], bytes] = OrderedDict()
+        self._bytes = 0
+
+    def get(self, model: str, text: str) -> bytes | None:
+        key = (model, text_hash(text))
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is not None:
+                self._entries.move_to_end(key)
+        if blob is not None:
+            self._metrics.incr(f"{self.name}.memory_hits")
+            return blob
+        if self._load is not None:
+            blob = self._load(*key)
+            if blob is not None:
+                self._metrics.incr(f"{self.name}.db_hits")
+                self._remember(key, blob)
+                return blob
+        self._metrics.incr(f"{self.name}.misses")
+        return None
+
+    def put(self, model: str, text: str, blob: bytes, *, persist: bool = True) -> None:
+        key = (model, text_hash(text))
+        self._remember(key, blob)
+        if persist and self._store is not None:
+            self._store(*key, blob)
+
+    def _remember(self, key: tuple[str, bytes], blob: bytes) -> None:
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = blob
+            self._bytes += len(blob)
+            evicted = 0
+            while self._bytes > self.max_bytes:
+                _, dropped = self._entries.popitem(last=False)
+                self._bytes -= len(dropped)
+                evicted += 1
+            size, entries = self._bytes, len(self._entries)
+        if evicted:
+            self._metrics.incr(f"{self.name}.evictions", evicted)
+        self._metrics.set(f"{self.name}.bytes", size)
+        self._metrics.set(f"{self.name}.entries", entries)
+
+
+class EmbeddingClient:
+    """Client for an OpenAI-compatible /v1/embeddings endpoint.
+
+    Requests go over a pool of up to `pool_size` persistent HTTP/1.1
+    connections. Failed requests (connection errors, timeouts, 429 and 5xx
+    responses) are retried up to `retries` times with exponential backoff;
+    a request that fails on a reused keep-alive connection the server has
+    since dropped is retried straight away on a fresh one.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        model: str,
+        *,
+        metrics: Metrics,
+        pool_size: int = 4,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        name: str = "embed_client",
+    ):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported embeddings URL: {url}")
+        self.url = url
+        self.model = model
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._metrics = metrics
+        self._scheme = parsed.scheme
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._path = parsed.path or "/"
+        if parsed.query:
+            self._path += "?" + parsed.query
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self._idle: list[http.client.HTTPConnection] = []
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        body = json.dumps({"model": self.model, "input": texts}).encode()
+        resp = json.loads(self._post(body))
+        return [item["embedding"] for item in sorted(resp["data"], key=lambda item: item["index"])]
+
+    def _post(self, body: bytes) -> bytes:
+        attempt = 0
+        while True:
+            conn, reused = self._checkout()
+            start = time.perf_counter()
+            try:
+                conn.request("POST", self._path, body, {"Content-Type": "application/json"})
+                conn.sock.settimeout(self.read_timeout)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                self._release(None)
+                self._metrics.incr(f"{self.name}.errors")
+                if reused and isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)):
+                    # The server closed an idle keep-alive connection; not a real failure
+                    continue
+                error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            else:
+                self._metrics.observe(f"{self.name}.request", time.perf_counter() - start)
+                self._release(None if resp.will_close else conn)
+                if resp.status == 200:
+                    return data
+                self._metrics.incr(f"{self.name}.errors")
+                error = f"HTTP {resp.status} {resp.reason}"
+                if resp.status != 429 and resp.status < 500:
+                    raise RuntimeError(f"Embedding API at {self.url} rejected the request: {error}")
+            if attempt >= self.retries:
+                raise RuntimeError(f"Embedding API unavailable at {self.url}: {error}")
+            self._metrics.incr(f"{self.name}.retries")
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def _checkout(self) -> tuple[http.client.HTTPConnection, bool]:
+        start = time.perf_counter()
+        self._slots.acquire()
+        self._metrics.observe(f"{self.name}.pool_wait", time.perf_counter() - start)
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        # Connects on first request, so connect errors are retried like any other
+        cls = http.client.HTTPSConnection if self._scheme == "https" else http.client.HTTPConnection
+        self._metrics.incr(f"{self.name}.connections_opened")
+        return cls(self._host, self._port, timeout=self.connect_timeout), False
+
+    def _release(self, conn: http.client.HTTPConnection | None) -> None:
+        if conn is not None:
+            with self._lock:
+                self._idle.append(conn)
+        self._slots.release()
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
@@ -0,0 +1,107 @@
+from typing import NamedTuple
+
+import numpy as np
+
+METHODS = ("rrf", "minmax", "zscore")
+
+
+class Leg(NamedTuple):
+    """One ranked list of candidates, best first.
+
+    `scores` are the leg's raw scores with lower meaning better (vector
+    distances, FTS5 ranks, which are negated bm25); only the min-max and
+    z-score methods need them.
+    """
+    ids: np.ndarray
+    scores: np.ndarray | None = None
+    weight: float = 1.0
+
+
+def leg(ids: list[int], scores: list[float] | None = None, weight: float = 1.0) -> Leg:
+    return Leg(
+        np.asarray(ids, dtype=np.int64),
+        None if scores is None else np.asarray(scores, dtype=np.float64),
+        weight,
+    )
+
+
+def _contributions(ranked: Leg, method: str, rrf_k: int) -> tuple[np.ndarray, float]:
+    """Each candidate's weighted score from this leg, higher is better, and the
+    score a candidate the leg didn't return gets, always below every hit's.
+
+    Being missing counts one unit below the leg's worst hit: min-max puts
+    hits in [0.5, 1] and missing candidates at 0, z-score puts them one
+    standard deviation under the worst hit. Hits that all score the same
+    (a single hit, say) get 1, and missing candidates 0.
+    """
+    if method == "rrf":
+        return ranked.weight / (rrf_k + np.arange(1, len(ranked.ids) + 1)), 0.0
+    if ranked.scores is None:
+        raise ValueError(f"{method} fusion needs raw scores for every leg")
+    low, high = ranked.scores.min(), ranked.scores.max()
+    if high == low:
+        return np.full(len(ranked.ids), ranked.weight), 0.0
+    if method == "minmax":
+        normalized = 0.5 + 0.5 * (high - ranked.scores) / (high - low)
+        missing = 0.0
+    else:
+        normalized = (ranked.scores.mean() - ranked.scores) / ranked.scores.std()
+        missing = float(normalized.min()) - 1
+    return ranked.weight * normalized, ranked.weight * missing
+
+
+def _union(all_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """np.unique(all_ids, return_index=True, return_inverse=True), without the
+    stable sort that return_index costs."""
+    order = np.argsort(all_ids)
+    sorted_ids = all_ids[order]
+    starts_group = np.empty(len(sorted_ids), dtype=bool)
+    starts_group[0] = True
+    np.not_equal(sorted_ids[1:], sorted_ids[:-1], out=starts_group[1:])
+    starts = np.flatnonzero(starts_group)
+    slots = np.empty(len(all_ids), dtype=np.intp)
+    slots[order] = np.cumsum(starts_group) - 1
+    return sorted_ids[starts], np.minimum.reduceat(order, starts), slots
+
+
+def fuse(legs: list[Leg], top_k: int, *, method: str = "rrf", rrf_k: int = 60) -> list[tuple[int, float]]:
+    """The top_k candidates across legs by combined score, best first, as (id, score).
+
+    - "rrf": weighted reciprocal rank fusion, sum of weight / (rrf_k + rank)
+    - "minmax": sum of weight x raw score rescaled to [0.5, 1] within its leg
+    - "zscore": sum of weight x raw score standardized within its leg
+
+    With min-max and z-score, a candidate a leg didn't return scores below
+    all of that leg's hits (see _contributions).
+
+    Ties go to whichever candidate appears first, reading the legs in order.
+    Only the top_k are sorted; the rest are cut with a partial selection.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown fusion method: {method}")
+    legs = [ranked for ranked in legs if len(ranked.ids)]
+    if not legs or top_k <= 0:
+        return []
+    all_ids = np.concatenate([ranked.ids for ranked in legs])
+    ids, first_seen, slots = _union(all_ids)
+    scores = np.zeros(len(ids))
+    offset = 0
+    for ranked in legs:
+        contributions, missing = _contributions(ranked, method, rrf_k)
+        present = np.zeros(len(ids), dtype=bool)
+        leg_slots = slots[offset:offset + len(ranked.ids)]
+        present[leg_slots] = True
+        # Ids are unique within a leg, so plain fancy-index assignment is enough
+        scores[leg_slots] += contributions
+        scores[~present] += missing
+        offset += len(ranked.ids)
+
+    if top_k < len(ids):
+        # argpartition breaks ties at the cut arbitrarily: keep everything tied with
+        # the k-th best, so first_seen decides among them below
+        kth = -np.partition(-scores, top_k - 1)[top_k - 1]
+        top = np.flatnonzero(scores >= kth)
+    else:
+        top = np.arange(len(ids))
+    top = top[np.lexsort((first_seen[top], -scores[top]))][:top_k]
+    return list(zip(ids[top].tolist(), scores[top].tolist()))
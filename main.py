@@ -1,19 +1,110 @@
-import json
+import argparse
+import logging
+import math
 import random
 import sqlite3
-import urllib.error
-import urllib.request
+import struct
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
 from pathlib import Path
 
 import sqlite_vec
 from sqlite_vec import serialize_float32
 from fastmcp import FastMCP
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from db import ConnectionPool, IdAllocator, Writer
+from embeddings import EmbeddingCache, EmbeddingClient, text_hash
+from fusion import METHODS as FUSION_METHODS, fuse, leg
+from metrics import Metrics
+from schema import migrate
+from vectors import (
+    HnswIndex, PcaIndex, PqIndex, QuantizedIndex, ResidentIndex, SqliteVecIndex, TruncatedIndex, VectorIndex
+)
 
 # Config
 EMBED_URL = "http://localhost:9090/v1/embeddings"
 EMBED_MODEL = "snowflake-arctic-embed-l-v2.0-q4_k_m.gguf"
 EMBED_DIMS = 1024
+EMBED_BATCH_SIZE = 64                      # texts per /v1/embeddings request in save_memories
+EMBED_POOL_SIZE = 4                        # persistent HTTP connections to the embeddings server
+EMBED_CONNECT_TIMEOUT = 5                  # seconds
+EMBED_READ_TIMEOUT = 60                    # seconds to wait for a response
+EMBED_RETRIES = 3                          # retries after connection errors, timeouts, 429s and 5xx
+EMBED_RETRY_BACKOFF = 0.5                  # seconds before the first retry, doubling after each
+EMBED_CACHE_MAX_BYTES = 64 * 1024 * 1024  # in-memory LRU of recent embeddings (~4 KB each at 1024 dims)
+EMBED_CACHE_PERSIST = True                 # also keep embeddings in the database across restarts
+EMBED_CACHE_PERSIST_DAYS = 30              # how long a search query's embedding stays in the database
 DB_PATH = Path("./engram.db")
+RECALL_HALF_LIFE_DAYS = 30   # default age weighting for randomly_remember(age='recent'/'old')
+SEARCH_CANDIDATES = 10       # candidates per requested result that each search leg feeds into fusion
+SEARCH_MAX_K = 4096          # upper bound on any leg's k (sqlite-vec's own KNN limit)
+# How search_memory combines the vector and keyword legs, unless a call picks
+# otherwise: "rrf" (weighted reciprocal rank fusion), or "minmax" / "zscore",
+# which combine the legs' normalized vector distances and bm25 scores.
+SEARCH_FUSION = "rrf"
+SEARCH_RRF_K = 60
+SEARCH_VECTOR_WEIGHT = 1.0
+SEARCH_KEYWORD_WEIGHT = 1.0
+# Give keyword matches the vector search didn't return their exact distance from
+# the query too, so they're ranked semantically as well (one vector lookup each).
+SEARCH_RESCORE = True
+# Run both search legs, fusion and the row fetch as one SQL statement instead of
+# separate queries. Only with VECTOR_SEARCH = "exact" and "rrf" fusion; it also
+# gives up running the keyword leg while the query is being embedded (see
+# bench/hybrid_query.py).
+SEARCH_SINGLE_QUERY = False
+# Vector search engine. "exact" compares the query against every float32 vector in
+# the collection. The others keep a smaller copy of each vector, search that first,
+# and rescore the best COARSE_OVERSAMPLE x top candidates exactly:
+#   "bit" / "int8"  quantized copy (128 B or 1 KB at 1024 dims, vs 4 KB)
+#   "matryoshka"    the first MATRYOSHKA_DIMS dims, renormalized (needs a model
+#                   trained for truncation, like snowflake-arctic-embed-l-v2.0)
+# The copy is built from existing vectors on the first start with it enabled.
+# "numpy" is exact too, but over in-RAM copies of recently searched collections,
+# up to RESIDENT_MAX_BYTES in total; larger collections are searched in SQLite.
+# "hnsw" searches an approximate HNSW graph per collection (needs `uv sync --extra
+# hnsw`), saved in HNSW_DIR on shutdown and caught up from the database on start.
+# "pq" keeps PQ_SUBVECTORS-byte product-quantized codes in RAM instead of float32
+# vectors; codebooks are trained once there are PQ_MIN_TRAIN vectors (until then,
+# search is exact), and `uv run main.py retrain` retrains them with the server stopped.
+# "pca" projects each collection onto its own top PCA_DIMS principal components,
+# fitted once it has PCA_MIN_FIT vectors and refitted in the background each time
+# it grows PCA_REFIT_GROWTH-fold; smaller collections are searched exactly.
+VECTOR_SEARCH = "exact"
+COARSE_OVERSAMPLE = 8
+MATRYOSHKA_DIMS = 256
+RESIDENT_MAX_BYTES = 512 * 1024 * 1024
+HNSW_DIR = DB_PATH.with_name(DB_PATH.name + ".hnsw")
+HNSW_M = 16                  # graph links per node: more is better recall, more memory
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64          # candidate list size at query time: recall vs latency
+PQ_SUBVECTORS = 128          # bytes per vector; must divide EMBED_DIMS
+PQ_PER_COLLECTION = False    # one codebook per collection rather than one for all
+PQ_RERANK = 4                # rescore PQ_RERANK x top candidates exactly; 0 to skip
+PQ_TRAIN_SAMPLE = 20000      # vectors sampled to train a codebook
+PQ_MIN_TRAIN = 5000          # vectors needed before a codebook is trained
+PCA_DIMS = 128
+PCA_MIN_FIT = 2000
+PCA_REFIT_GROWTH = 2.0
+PCA_FIT_SAMPLE = 10000       # vectors sampled to fit a projection
+PCA_RECALL_SAMPLE = 0.02     # share of searches also run exactly, to report recall per collection
+DB_POOL_SIZE = 8             # max concurrent connections handed out to tool calls
+DB_POOL_IDLE_TIMEOUT = 300   # seconds before an idle pooled connection is closed
+DB_CACHE_SIZE_KB = 16384     # per-connection page cache
+DB_BUSY_TIMEOUT_MS = 5000    # how long a connection waits on a lock held by another process
+WAL_AUTOCHECKPOINT_PAGES = 1000  # SQLite's own checkpoint threshold; 0 disables it
+WAL_CHECKPOINT_INTERVAL = 30     # seconds of writer idleness before an explicit checkpoint; 0 disables
+WAL_CHECKPOINT_MODE = "PASSIVE"  # PASSIVE, FULL, RESTART or TRUNCATE
+# Durability vs. throughput: with WRITE_BEHIND on, save_memory returns as soon as
+# the memory is queued (with its final id) and saves are committed in groups every
+# GROUP_COMMIT_INTERVAL_MS or GROUP_COMMIT_MAX_ITEMS, whichever comes first.
+# Queued saves are flushed on shutdown but lost on a crash or power failure.
+WRITE_BEHIND = False
+GROUP_COMMIT_INTERVAL_MS = 50
+GROUP_COMMIT_MAX_ITEMS = 256
 
 mcp = FastMCP(
     name="engram",
@@ -21,60 +112,240 @@ mcp = FastMCP(
 )
 
 
-def get_db() -> sqlite3.Connection:
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    db = sqlite3.connect(DB_PATH)
+metrics = Metrics()
+
+
+def init_connection(db: sqlite3.Connection) -> None:
     db.enable_load_extension(True)
     sqlite_vec.load(db)
     db.enable_load_extension(False)
-    db.execute("""
-        CREATE TABLE IF NOT EXISTS memories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            collection TEXT NOT NULL,
-            text TEXT NOT NULL,
-            created_at TEXT DEFAULT (datetime('now'))
+    db.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    db.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    db.execute("PRAGMA temp_store = MEMORY")
+
+
+def init_read_connection(db: sqlite3.Connection) -> None:
+    init_connection(db)
+    db.execute("PRAGMA query_only = ON")
+
+
+def init_write_connection(db: sqlite3.Connection) -> None:
+    init_connection(db)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute(f"PRAGMA wal_autocheckpoint = {WAL_AUTOCHECKPOINT_PAGES}")
+
+
+# Tool calls read through the pool; every write goes through the single writer
+db_pool = ConnectionPool(
+    DB_PATH,
+    size=DB_POOL_SIZE,
+    idle_timeout=DB_POOL_IDLE_TIMEOUT,
+    init=init_read_connection,
+    metrics=metrics,
+    name="db_pool",
+)
+writer = Writer(
+    DB_PATH,
+    init=init_write_connection,
+    metrics=metrics,
+    checkpoint_interval=WAL_CHECKPOINT_INTERVAL,
+    checkpoint_mode=WAL_CHECKPOINT_MODE,
+    batch_window=GROUP_COMMIT_INTERVAL_MS / 1000,
+    batch_max_items=GROUP_COMMIT_MAX_ITEMS,
+)
+
+
+def last_memory_id() -> int:
+    with db_pool.connection() as db:
+        return db.execute("""
+            SELECT MAX(
+                COALESCE((SELECT MAX(id) FROM memories), 0),
+                COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'memories'), 0)
+            )
+        """).fetchone()[0]
+
+
+# Ids are assigned before the INSERT so write-behind saves can report them
+memory_ids = IdAllocator(last_memory_id)
+
+
+def make_vector_index() -> VectorIndex:
+    options = dict(oversample=COARSE_OVERSAMPLE, metrics=metrics, max_k=SEARCH_MAX_K)
+    if VECTOR_SEARCH == "exact":
+        return exact_index
+    if VECTOR_SEARCH in ("bit", "int8"):
+        return QuantizedIndex(VECTOR_SEARCH, EMBED_DIMS, **options)
+    if VECTOR_SEARCH == "matryoshka":
+        return TruncatedIndex(MATRYOSHKA_DIMS, **options)
+    if VECTOR_SEARCH == "numpy":
+        return ResidentIndex(EMBED_DIMS, max_bytes=RESIDENT_MAX_BYTES, metrics=metrics)
+    if VECTOR_SEARCH == "pq":
+        return PqIndex(
+            EMBED_DIMS, subvectors=PQ_SUBVECTORS, per_collection=PQ_PER_COLLECTION, rerank=PQ_RERANK,
+            train_sample=PQ_TRAIN_SAMPLE, min_train=PQ_MIN_TRAIN, max_bytes=RESIDENT_MAX_BYTES, metrics=metrics,
+        )
+    if VECTOR_SEARCH == "pca":
+        return PcaIndex(
+            PCA_DIMS, oversample=COARSE_OVERSAMPLE, min_fit=PCA_MIN_FIT, refit_growth=PCA_REFIT_GROWTH,
+            fit_sample=PCA_FIT_SAMPLE, recall_sample=PCA_RECALL_SAMPLE,
+            read=db_pool.connection, write=writer.submit, metrics=metrics, max_k=SEARCH_MAX_K,
+        )
+    if VECTOR_SEARCH == "hnsw":
+        return HnswIndex(
+            EMBED_DIMS, HNSW_DIR, metrics=metrics,
+            m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH,
         )
-    """)
-    db.execute(f"""
-        CREATE VIRTUAL TABLE IF NOT EXISTS memory_vecs USING vec0(
-            embedding FLOAT[{EMBED_DIMS}]
+    raise ValueError(f"Unknown VECTOR_SEARCH: {VECTOR_SEARCH}")
+
+
+# Every engine falls back to (or is) exact KNN over memory_vecs
+exact_index = SqliteVecIndex(metrics=metrics, max_k=SEARCH_MAX_K)
+vector_index = make_vector_index()
+
+
+def init_db() -> None:
+    """Switch to WAL, run pending schema migrations and catch up the vector
+    index. Called once at startup, never per request."""
+    writer.run(lambda db: migrate(db, EMBED_DIMS), transaction=False)
+    added = writer.run(vector_index.sync)
+    if added:
+        logging.getLogger("engram").info("Added %d vectors to %s", added, vector_index.name)
+
+
+def load_cached_embedding(model: str, text_hash: bytes) -> bytes | None:
+    # Saved texts' rows point at the memory's vector rather than copying it
+    with db_pool.connection() as db:
+        row = db.execute("""
+            SELECT COALESCE(embedding, (SELECT embedding FROM memory_vecs WHERE rowid = memory_id))
+            FROM embedding_cache
+            WHERE model = ? AND text_hash = ?
+        """, [model, text_hash]).fetchone()
+    return row[0] if row else None
+
+
+def store_cached_embedding(model: str, text_hash: bytes, blob: bytes) -> None:
+    """Keep a search query's embedding, pruning ones older than EMBED_CACHE_PERSIST_DAYS."""
+    def store(db: sqlite3.Connection) -> None:
+        db.execute(
+            "INSERT OR REPLACE INTO embedding_cache(model, text_hash, embedding) VALUES (?, ?, ?)",
+            [model, text_hash, blob]
         )
-    """)
-    db.execute("""
-        CREATE VIRTUAL TABLE IF NOT EXISTS memory_fts USING fts5(
-            text,
-            tokenize='porter ascii'
+        db.execute(
+            "DELETE FROM embedding_cache WHERE embedding IS NOT NULL AND created_at < datetime('now', ?)",
+            [f"-{EMBED_CACHE_PERSIST_DAYS} days"]
         )
-    """)
-    # Migrate: populate FTS for any memories not yet indexed
-    db.execute("""
-        INSERT INTO memory_fts(rowid, text)
-        SELECT id, text FROM memories
-        WHERE id NOT IN (SELECT rowid FROM memory_fts)
-    """)
-    db.commit()
-    return db
+
+    # Nobody waits on a cache fill, so let it ride along with the next commit
+    writer.submit(store, deferred=True)
+
+
+embedding_client = EmbeddingClient(
+    EMBED_URL,
+    EMBED_MODEL,
+    metrics=metrics,
+    pool_size=EMBED_POOL_SIZE,
+    connect_timeout=EMBED_CONNECT_TIMEOUT,
+    read_timeout=EMBED_READ_TIMEOUT,
+    retries=EMBED_RETRIES,
+    backoff=EMBED_RETRY_BACKOFF,
+)
+embedding_cache = EmbeddingCache(
+    max_bytes=EMBED_CACHE_MAX_BYTES,
+    metrics=metrics,
+    load=load_cached_embedding if EMBED_CACHE_PERSIST else None,
+    store=store_cached_embedding if EMBED_CACHE_PERSIST else None,
+)
 
 
 def get_embedding(text: str) -> list[float]:
-    data = json.dumps({"model": EMBED_MODEL, "input": text}).encode()
-    req = urllib.request.Request(
-        EMBED_URL, data=data,
-        headers={"Content-Type": "application/json"}
+    return get_embeddings([text])[0]
+
+
+def query_embedding(text: str) -> list[float]:
+    """get_embedding for a search query, which is also kept in the database."""
+    return get_embeddings([text], persist=True)[0]
+
+
+def get_embeddings(texts: list[str], *, persist: bool = False) -> list[list[float]]:
+    """Embed texts, serving what we can from the cache and batching the rest.
+
+    New embeddings go in the database tier only with `persist`: texts being
+    saved don't need it, since insert_memories points the cache at their
+    memory_vecs rows instead.
+    """
+    embeddings: list[list[float] | None] = [None] * len(texts)
+    missing = []
+    for i, text in enumerate(texts):
+        blob = embedding_cache.get(EMBED_MODEL, text)
+        if blob is None:
+            missing.append(i)
+        else:
+            embeddings[i] = list(struct.unpack(f"{len(blob) // 4}f", blob))
+    for start in range(0, len(missing), EMBED_BATCH_SIZE):
+        batch = missing[start:start + EMBED_BATCH_SIZE]
+        for i, embedding in zip(batch, embedding_client.embed([texts[i] for i in batch])):
+            embeddings[i] = embedding
+            embedding_cache.put(EMBED_MODEL, texts[i], serialize_float32(embedding), persist=persist)
+    return embeddings
+
+
+def insert_memories(db: sqlite3.Connection, collection: str, rows: list[tuple[int, str, list[float]]]) -> None:
+    """Insert (id, text, embedding) rows. Runs on the writer; triggers index the
+    text and update the collection's stats."""
+    db.executemany(
+        "INSERT INTO memories(id, collection, text) VALUES (?, ?, ?)",
+        [(memory_id, collection, text) for memory_id, text, _ in rows]
     )
-    try:
-        resp = json.loads(urllib.request.urlopen(req).read())
-    except urllib.error.URLError as e:
-        raise RuntimeError(f"Embedding API unavailable at {EMBED_URL}: {e.reason}") from e
-    return resp["data"][0]["embedding"]
+    db.executemany(
+        "INSERT INTO memory_vecs(rowid, collection, embedding) VALUES (?, ?, ?)",
+        [(memory_id, collection, serialize_float32(embedding)) for memory_id, _, embedding in rows]
+    )
+    vector_index.stage(db, collection, [(memory_id, embedding) for memory_id, _, embedding in rows])
+    if EMBED_CACHE_PERSIST:
+        db.executemany(
+            "INSERT OR REPLACE INTO embedding_cache(model, text_hash, memory_id) VALUES (?, ?, ?)",
+            [(EMBED_MODEL, text_hash(text), memory_id) for memory_id, text, _ in rows]
+        )
+    # Triggers keep the rest of the collection's stats; vec0 tables can't have any
+    db.execute(
+        "UPDATE collections SET vector_count = vector_count + ? WHERE name = ?",
+        [len(rows), collection]
+    )
+
+
+def store_memories(collection: str, rows: list[tuple[int, str, list[float]]]) -> None:
+    """Queue rows for insert_memories, waiting for the commit unless WRITE_BEHIND."""
+    future = writer.submit(lambda db: insert_memories(db, collection, rows), deferred=WRITE_BEHIND)
+
+    # Only once committed, so searches never see a save that rolled back
+    def write_through(future: Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            vector_index.add(collection, [(memory_id, embedding) for memory_id, _, embedding in rows])
+
+    if WRITE_BEHIND:
+        future.add_done_callback(write_through)
+    else:
+        future.result()
+        write_through(future)
+
 
+def fts_phrase(text: str) -> str:
+    """Quote text as an FTS5 phrase."""
+    return '"' + text.replace('"', '""') + '"'
 
-def reciprocal_rank_fusion(rankings: list[list[int]], k: int = 60) -> list[tuple[int, float]]:
-    scores: dict[int, float] = {}
-    for ranking in rankings:
-        for rank, doc_id in enumerate(ranking):
-            scores[doc_id] = scores.get(doc_id, 0) + 1 / (k + rank + 1)
-    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+def fts_match(collection: str, query: str) -> str:
+    """The MATCH expression for query within collection's postings.
+
+    The collection phrase is token-based, so a name that's a prefix of another
+    (e.g. 'notes' and 'notes-old') can still match the other, and a name the
+    ascii tokenizer finds no tokens in (e.g. '---') would match nothing: that
+    one searches every collection's postings instead. Either way, callers
+    join against memories to keep only the collection's own rows.
+    """
+    if any(not ch.isascii() or ch.isalnum() for ch in collection):
+        return f'collection : ^{fts_phrase(collection)} AND text : ({query})'
+    return f'text : ({query})'
 
 
 @mcp.tool()
@@ -86,158 +357,513 @@ def save_memory(collection: str, text: str) -> str:
         collection: Name of the collection (e.g. 'liv-memories', 'research-notes')
         text: The memory text to store
     """
-    db = get_db()
     try:
         embedding = get_embedding(text)
     except RuntimeError as e:
         return str(e)
-    cursor = db.execute(
-        "INSERT INTO memories(collection, text) VALUES (?, ?)",
-        [collection, text]
-    )
-    memory_id = cursor.lastrowid
-    db.execute(
-        "INSERT INTO memory_vecs(rowid, embedding) VALUES (?, ?)",
-        [memory_id, serialize_float32(embedding)]
-    )
-    db.execute(
-        "INSERT INTO memory_fts(rowid, text) VALUES (?, ?)",
-        [memory_id, text]
-    )
-    db.commit()
+    memory_id = memory_ids.reserve()
+    store_memories(collection, [(memory_id, text, embedding)])
     return f"Saved memory #{memory_id} to collection '{collection}'"
 
 
 @mcp.tool()
-def search_memory(collection: str, query: str, top_k: int = 5) -> str:
-    """Search a memory collection by semantic similarity and keyword matching.
-    Combines vector search and full-text search via reciprocal rank fusion.
+def save_memories(collection: str, texts: list[str]) -> str:
+    """Save many memories to a named collection at once, e.g. when importing notes.
+    Much faster than calling save_memory repeatedly: texts are embedded in batches
+    and stored in a single transaction. Creates the collection automatically.
 
     Args:
-        collection: Name of the collection to search
-        query: What you're looking for (in any language)
-        top_k: Number of results to return (default 5)
+        collection: Name of the collection (e.g. 'liv-memories', 'research-notes')
+        texts: The memory texts to store, one memory per entry
     """
-    db = get_db()
+    if not texts:
+        return "No memories to save"
     try:
-        embedding = get_embedding(query)
+        embeddings = get_embeddings(texts)
     except RuntimeError as e:
         return str(e)
-
-    # Vector search — over-fetch then filter by collection
-    vec_results = db.execute("""
-        SELECT m.id, m.collection
-        FROM memory_vecs v
-        JOIN memories m ON m.id = v.rowid
-        WHERE v.embedding MATCH ?
-          AND k = ?
-        ORDER BY v.distance
-    """, [serialize_float32(embedding), top_k * 10]).fetchall()
-
-    vec_ids = [id for id, coll in vec_results if coll == collection]
-
-    # FTS search — filter by collection in join
-    fts_results = db.execute("""
-        SELECT m.id
+    first_id = memory_ids.reserve(len(texts))
+    ids = list(range(first_id, first_id + len(texts)))
+    store_memories(collection, list(zip(ids, texts, embeddings)))
+    id_list = ", ".join(f"#{memory_id}" for memory_id in ids)
+    return f"Saved {len(ids)} memories to collection '{collection}': {id_list}"
+
+
+def collection_size(db: sqlite3.Connection, collection: str) -> int:
+    row = db.execute("SELECT memory_count FROM collections WHERE name = ?", [collection]).fetchone()
+    return row[0] if row else 0
+
+
+def vector_leg(db: sqlite3.Connection, collection: str, embedding: list[float], want: int) -> list[tuple[int, float]]:
+    """(id, distance) of the nearest memories in the collection, best first."""
+    hits = vector_index.nearest(db, collection, embedding, want)
+    if hits is None:
+        hits = exact_index.nearest(db, collection, embedding, want)
+    return hits
+
+
+def rescore(
+    db: sqlite3.Connection,
+    collection: str,
+    embedding: list[float],
+    vec_hits: list[tuple[int, float]],
+    fts_hits: list[tuple[int, float]],
+) -> list[tuple[int, float]]:
+    """The vector leg with the keyword leg's hits it missed merged in at their
+    exact distance, nearest first.
+
+    Costs one distance per missed hit rather than a second KNN query, so it's
+    bounded by the keyword leg's depth whatever the collection's size.
+    """
+    returned = {id for id, _ in vec_hits}
+    missed = [id for id, _ in fts_hits if id not in returned]
+    metrics.record("search.rescored", len(missed))
+    if not missed:
+        return vec_hits
+    # Stable, so ties stay in leg order: vector hits, then keyword hits
+    return sorted(vec_hits + vector_index.distances(db, collection, embedding, missed), key=lambda hit: hit[1])
+
+
+def fts_leg(db: sqlite3.Connection, collection: str, query: str, want: int) -> list[tuple[int, float]]:
+    """(id, FTS5 rank) of the collection's best keyword matches for query, best
+    first. The rank is bm25 negated, so lower is better."""
+    # Filtered before the limit, so other collections' matches can't crowd these out
+    return db.execute("""
+        SELECT f.rowid, f.rank
         FROM memory_fts f
         JOIN memories m ON m.id = f.rowid
-        WHERE f.text MATCH ?
+        WHERE f.memory_fts MATCH ?
           AND m.collection = ?
-        ORDER BY rank
+        ORDER BY f.rank
         LIMIT ?
-    """, [query, collection, top_k * 10]).fetchall()
+    """, [fts_match(collection, query), collection, min(want, SEARCH_MAX_K)]).fetchall()
+
+
+def timed_embedding(text: str) -> tuple[list[float], float]:
+    start = time.perf_counter()
+    embedding = query_embedding(text)
+    elapsed = time.perf_counter() - start
+    metrics.observe("search.embed", elapsed)
+    return embedding, elapsed
+
+
+# Runs query embeddings in the background while the FTS leg runs
+search_executor = ThreadPoolExecutor(max_workers=EMBED_POOL_SIZE, thread_name_prefix="search-embed")
+
+
+def hybrid_query(
+    db: sqlite3.Connection,
+    collection: str,
+    query: str,
+    embedding: list[float],
+    depth: int,
+    vec_k: int,
+    top_k: int,
+    weights: tuple[float, float] = (1.0, 1.0),
+    rescore: bool = False,
+) -> list[tuple[int, str, str, float]]:
+    """Both search legs, weighted reciprocal rank fusion and the row fetch as one
+    statement. `weights` are the vector and keyword legs' weights; `rescore`
+    ranks the keyword hits the KNN missed into the vector leg, like rescore().
+
+    Gives the same (id, text, created_at, score) rows as fusing fts_leg and an
+    exact vector_leg with fusion.fuse, ties included. The keyword leg keeps
+    only the collection's own matches before taking the best `depth`, as
+    fts_leg does.
+    """
+    return db.execute("""
+        WITH knn AS MATERIALIZED (
+            SELECT rowid AS id, distance, ROW_NUMBER() OVER (ORDER BY distance) AS rank
+            FROM memory_vecs
+            WHERE embedding MATCH :embedding
+              AND k = :vec_k
+              AND collection = :collection
+        ),
+        fts AS MATERIALIZED (
+            SELECT id, ROW_NUMBER() OVER (ORDER BY rank) AS rank
+            FROM (
+                -- Filtered before the limit, so other collections' matches can't crowd these out
+                SELECT f.rowid AS id, f.rank
+                FROM memory_fts f
+                JOIN memories m ON m.id = f.rowid
+                WHERE f.memory_fts MATCH :fts_query
+                  AND m.collection = :collection
+                ORDER BY f.rank
+                LIMIT :depth
+            )
+        ),
+        vec AS (
+            SELECT id, ROW_NUMBER() OVER (ORDER BY distance, leg, rank) AS rank
+            FROM (
+                SELECT id, distance, 0 AS leg, rank FROM knn
+                UNION ALL
+                SELECT id, (
+                    -- a rowid lookup, like vectors.exact_distances
+                    SELECT vec_distance_l2(v.embedding, :embedding) FROM memory_vecs v WHERE v.rowid = fts.id
+                ) AS distance, 1 AS leg, rank
+                FROM fts
+                WHERE :rescore AND id NOT IN (SELECT id FROM knn)
+            )
+            WHERE distance IS NOT NULL
+        ),
+        fused AS (
+            -- first_seen orders ties like fusion.fuse: vector ranks, then keyword ranks.
+            -- With rescoring the vector leg can hold up to 2 x depth candidates.
+            SELECT id, SUM(weight / (:rrf_k + rank)) AS score, MIN(leg * 2 * :depth + rank) AS first_seen
+            FROM (
+                SELECT id, rank, 0 AS leg, :vector_weight AS weight FROM vec
+                UNION ALL
+                SELECT id, rank, 1 AS leg, :keyword_weight AS weight FROM fts
+            )
+            GROUP BY id
+        )
+        SELECT m.id, m.text, m.created_at, fused.score
+        FROM fused
+        JOIN memories m ON m.id = fused.id
+        ORDER BY fused.score DESC, fused.first_seen
+        LIMIT :top_k
+    """, {
+        "embedding": serialize_float32(embedding),
+        "vec_k": vec_k,
+        "collection": collection,
+        "fts_query": fts_match(collection, query),
+        "depth": max(depth, vec_k),
+        "rrf_k": SEARCH_RRF_K,
+        "vector_weight": float(weights[0]),
+        "keyword_weight": float(weights[1]),
+        "rescore": rescore,
+        "top_k": top_k,
+    }).fetchall()
+
+
+def search_in_steps(
+    collection: str, query: str, depth: int, size: int, top_k: int, fusion: str, weights: tuple[float, float]
+) -> list[tuple[int, str, str, float]]:
+    """Keyword leg, vector leg, fusion and fetch as separate steps. The keyword
+    leg runs while the query is being embedded."""
+    with db_pool.connection() as db:
+        # The FTS leg doesn't need the embedding: run it during the HTTP round trip
+        pending_embedding = search_executor.submit(timed_embedding, query)
+        with metrics.timer("search.fts"):
+            fts_hits = fts_leg(db, collection, query, depth)
+
+    wait_start = time.perf_counter()
+    embedding, embed_time = pending_embedding.result()
+    waited = time.perf_counter() - wait_start
+    metrics.observe("search.embed_wait", waited)
+    # How much of the embedding request was hidden behind the FTS leg
+    metrics.observe("search.overlap", max(embed_time - waited, 0.0))
+
+    with db_pool.connection() as db:
+        with metrics.timer("search.vec"):
+            vec_hits = vector_leg(db, collection, embedding, min(depth, size))
+        if SEARCH_RESCORE:
+            with metrics.timer("search.rescore"):
+                vec_hits = rescore(db, collection, embedding, vec_hits, fts_hits)
+
+        vec = leg([id for id, _ in vec_hits], [distance for _, distance in vec_hits], weights[0])
+        fts = leg([id for id, _ in fts_hits], [rank for _, rank in fts_hits], weights[1])
+        with metrics.timer("search.fuse"):
+            fused = fuse([vec, fts], top_k, method=fusion, rrf_k=SEARCH_RRF_K)
+        if not fused:
+            return []
+
+        # Fetch full records in fused order
+        placeholders = ",".join("?" * len(fused))
+        with metrics.timer("search.fetch"):
+            rows = db.execute(
+                f"SELECT id, text, created_at FROM memories WHERE id IN ({placeholders})",
+                [id for id, _ in fused]
+            ).fetchall()
 
-    fts_ids = [id for (id,) in fts_results]
+    # Re-sort to match fused order
+    row_map = {id: (text, created_at) for id, text, created_at in rows}
+    return [(id, *row_map[id], score) for id, score in fused if id in row_map]
+
+
+def search_in_one_query(
+    collection: str, query: str, depth: int, size: int, top_k: int, fusion: str, weights: tuple[float, float]
+) -> list[tuple[int, str, str, float]]:
+    embedding, _ = timed_embedding(query)
+    # The same cap the step-by-step legs put on k: vec0 refuses k above it
+    depth = min(depth, SEARCH_MAX_K)
+    with db_pool.connection() as db, metrics.timer("search.hybrid"):
+        return hybrid_query(
+            db, collection, query, embedding, depth, min(depth, size), top_k, weights, rescore=SEARCH_RESCORE
+        )
 
-    # Reciprocal rank fusion
-    fused = reciprocal_rank_fusion([vec_ids, fts_ids])
-    top_ids = [id for id, _ in fused[:top_k]]
 
-    if not top_ids:
+@mcp.tool()
+def search_memory(
+    collection: str,
+    query: str,
+    top_k: int = 5,
+    fusion: str = SEARCH_FUSION,
+    vector_weight: float = SEARCH_VECTOR_WEIGHT,
+    keyword_weight: float = SEARCH_KEYWORD_WEIGHT,
+) -> str:
+    """Search a memory collection by semantic similarity and keyword matching.
+    Combines vector search and full-text search, by default via reciprocal rank fusion.
+
+    Args:
+        collection: Name of the collection to search
+        query: What you're looking for (in any language)
+        top_k: Number of results to return (default 5)
+        fusion: How to combine the two rankings: 'rrf' (by rank), or 'minmax' /
+            'zscore' (by normalized semantic distance and keyword relevance)
+        vector_weight: Weight of the semantic ranking (default 1.0)
+        keyword_weight: Weight of the keyword ranking (default 1.0)
+    """
+    if fusion not in FUSION_METHODS:
+        return f"Unknown fusion '{fusion}', expected one of: {', '.join(FUSION_METHODS)}"
+    depth = top_k * SEARCH_CANDIDATES
+    start = time.perf_counter()
+
+    with db_pool.connection() as db:
+        size = collection_size(db, collection)
+    if not size:
         return f"No memories found in collection '{collection}'"
+    # Only exact search over memory_vecs and rank fusion can run inside the SQL statement
+    single_query = SEARCH_SINGLE_QUERY and vector_index is exact_index and fusion == "rrf"
+    search = search_in_one_query if single_query else search_in_steps
+    try:
+        results = search(collection, query, depth, size, top_k, fusion, (vector_weight, keyword_weight))
+    except RuntimeError as e:
+        return str(e)
+    metrics.observe("search.total", time.perf_counter() - start)
 
-    # Fetch full records in fused order
-    placeholders = ",".join("?" * len(top_ids))
-    rows = db.execute(
-        f"SELECT id, text, created_at FROM memories WHERE id IN ({placeholders})",
-        top_ids
-    ).fetchall()
+    if not results:
+        return f"No memories found in collection '{collection}'"
+    return "\n\n---\n\n".join(
+        f"[#{id} · {created_at}] (score: {score:.3f})\n{text}" for id, text, created_at, score in results
+    )
 
-    # Re-sort to match fused order
-    row_map = {id: (text, created_at) for id, text, created_at in rows}
-    lines = []
-    for id, score in fused[:top_k]:
-        if id not in row_map:
+
+def sample_memories(db: sqlite3.Connection, collection: str, n: int) -> list[tuple[int, str, str]]:
+    """Up to n distinct memories drawn uniformly at random, without scanning the collection.
+
+    Each draw is a single (collection, seq) index seek. Where deletes left holes
+    in seq, a draw lands on the next memory after the hole instead.
+    """
+    stats = db.execute(
+        "SELECT memory_count, max_seq FROM collections WHERE name = ?", [collection]
+    ).fetchone()
+    if not stats or not stats[0]:
+        return []
+    count, max_seq = stats
+    n = min(n, count)
+    if count == max_seq:
+        seqs = random.sample(range(1, max_seq + 1), n)
+        placeholders = ",".join("?" * n)
+        rows = db.execute(f"""
+            SELECT id, text, created_at FROM memories
+            WHERE collection = ? AND seq IN ({placeholders})
+        """, [collection, *seqs]).fetchall()
+        random.shuffle(rows)
+        return rows
+
+    found: dict[int, tuple[int, str, str]] = {}
+    for _ in range(n * 4):
+        row = db.execute("""
+            SELECT id, text, created_at FROM memories
+            WHERE collection = ? AND seq >= ?
+            ORDER BY seq
+            LIMIT 1
+        """, [collection, random.randint(1, max_seq)]).fetchone()
+        if row is None:
             continue
-        text, created_at = row_map[id]
-        lines.append(f"[#{id} · {created_at}] (score: {score:.3f})\n{text}")
+        found[row[0]] = row
+        if len(found) == n:
+            break
+    return list(found.values())
+
 
-    return "\n\n---\n\n".join(lines)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"  # created_at, as written by datetime('now')
+
+
+def sample_by_age(
+    db: sqlite3.Connection, collection: str, n: int, half_life: timedelta, newest: bool
+) -> list[tuple[int, str, str]]:
+    """Up to n distinct memories, weighted towards the newest (or oldest) by half-life.
+
+    Each draw picks a target time from an exponential distribution truncated to
+    the collection's lifetime, then seeks the (collection, created_at) index to
+    the memory at or before it (at or after, for the oldest). Memories saved in
+    the same second are then told apart by a random id between the first and
+    last of them. Every step is an index seek, so a draw costs O(log n).
+    """
+    stats = db.execute(
+        "SELECT memory_count, first_created, last_updated FROM collections WHERE name = ?",
+        [collection]
+    ).fetchone()
+    if not stats or not stats[0]:
+        return []
+    count, first, last = stats
+    first = datetime.strptime(first, TIMESTAMP_FORMAT)
+    last = datetime.strptime(last, TIMESTAMP_FORMAT)
+    span = (last - first).total_seconds()
+    rate = math.log(2) / half_life.total_seconds()
+    # Fraction of the untruncated distribution that falls within the span
+    within = -math.expm1(-rate * span)
+
+    found: dict[int, tuple[int, str, str]] = {}
+    for _ in range(min(n, count) * 4):
+        offset = -math.log1p(-random.random() * within) / rate if within else 0.0
+        if newest:
+            target = (last - timedelta(seconds=offset)).strftime(TIMESTAMP_FORMAT)
+            row = db.execute("""
+                SELECT created_at FROM memories
+                WHERE collection = ? AND created_at <= ?
+                ORDER BY created_at DESC
+                LIMIT 1
+            """, [collection, target]).fetchone()
+        else:
+            target = (first + timedelta(seconds=offset)).strftime(TIMESTAMP_FORMAT)
+            row = db.execute("""
+                SELECT created_at FROM memories
+                WHERE collection = ? AND created_at >= ?
+                ORDER BY created_at ASC
+                LIMIT 1
+            """, [collection, target]).fetchone()
+        if row is None:
+            continue
+        created_at = row[0]
+        lowest, highest = (
+            db.execute(f"""
+                SELECT id FROM memories
+                WHERE collection = ? AND created_at = ?
+                ORDER BY id {direction}
+                LIMIT 1
+            """, [collection, created_at]).fetchone()[0]
+            for direction in ("ASC", "DESC")
+        )
+        row = db.execute("""
+            SELECT id, text, created_at FROM memories
+            WHERE collection = ? AND created_at = ? AND id >= ?
+            ORDER BY id
+            LIMIT 1
+        """, [collection, created_at, random.randint(lowest, highest)]).fetchone()
+        found[row[0]] = row
+        if len(found) == min(n, count):
+            break
+    return list(found.values())
 
 
 @mcp.tool()
-def randomly_remember(collection: str, age: str = "any") -> str:
-    """Retrieve a random memory from a collection, optionally weighted by age.
+def randomly_remember(
+    collection: str, age: str = "any", count: int = 1, half_life_days: float | None = None
+) -> str:
+    """Retrieve random memories from a collection, optionally weighted by age.
 
     Args:
         collection: Name of the collection
-        age: 'recent' to draw from newest memories, 'old' to draw from oldest,
+        age: 'recent' to favour newer memories, 'old' to favour older ones,
              'any' for fully random (default)
+        count: How many distinct memories to return (default 1)
+        half_life_days: For 'recent'/'old': how quickly the preference fades.
+            A memory this many days further from the newest (or oldest) one
+            is half as likely to come up. Defaults to 30.
     """
-    db = get_db()
-
-    if age == "recent":
-        rows = db.execute("""
-            SELECT id, text, created_at FROM memories
-            WHERE collection = ?
-            ORDER BY created_at DESC
-            LIMIT 20
-        """, [collection]).fetchall()
-    elif age == "old":
-        rows = db.execute("""
-            SELECT id, text, created_at FROM memories
-            WHERE collection = ?
-            ORDER BY created_at ASC
-            LIMIT 20
-        """, [collection]).fetchall()
-    else:
-        rows = db.execute("""
-            SELECT id, text, created_at FROM memories
-            WHERE collection = ?
-            ORDER BY RANDOM()
-            LIMIT 1
-        """, [collection]).fetchall()
+    if count < 1:
+        return "count must be at least 1"
+    days = RECALL_HALF_LIFE_DAYS if half_life_days is None else half_life_days
+    # timedelta can't hold more days than that; NaN fails the comparison too
+    if not 0 < days <= timedelta.max.days:
+        return f"half_life_days must be positive and at most {timedelta.max.days:,}"
+    half_life = timedelta(days=days)
+    if half_life <= timedelta(0):
+        # Under a microsecond
+        return "half_life_days must be positive"
+    with db_pool.connection() as db:
+        if age in ("recent", "old"):
+            rows = sample_by_age(db, collection, count, half_life, newest=age == "recent")
+        else:
+            rows = sample_memories(db, collection, count)
 
     if not rows:
         return f"No memories found in collection '{collection}'"
 
-    id, text, created_at = random.choice(rows)
-    return f"[#{id} · {created_at}]\n{text}"
+    return "\n\n---\n\n".join(
+        f"[#{id} · {created_at}]\n{text}" for id, text, created_at in rows
+    )
 
 
-@mcp.tool()
-def list_collections() -> str:
-    """List all memory collections with their memory counts and last update time."""
-    db = get_db()
-    results = db.execute("""
-        SELECT collection, COUNT(*) as count, MAX(created_at) as last_updated
-        FROM memories
-        GROUP BY collection
+def format_bytes(n: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def collection_stats(db: sqlite3.Connection) -> list[tuple[str, int, int, int, str]]:
+    """(name, memory_count, text_bytes, vector_count, last_updated) of every
+    non-empty collection, most recently updated first."""
+    return db.execute("""
+        SELECT name, memory_count, text_bytes, vector_count, last_updated
+        FROM collections
+        WHERE memory_count > 0
         ORDER BY last_updated DESC
     """).fetchall()
 
+
+@mcp.tool()
+def list_collections() -> str:
+    """List all memory collections with their memory counts, sizes and last update time."""
+    with db_pool.connection() as db:
+        results = collection_stats(db)
+
     if not results:
         return "No collections yet"
 
     lines = [
-        f"{coll}: {count} {'memory' if count == 1 else 'memories'} (last updated: {updated})"
-        for coll, count, updated in results
+        f"{coll}: {count} {'memory' if count == 1 else 'memories'}, "
+        f"{format_bytes(text_bytes)} text, {vectors} vectors ({format_bytes(vectors * EMBED_DIMS * 4)}) "
+        f"(last updated: {updated})"
+        for coll, count, text_bytes, vectors, updated in results
     ]
     return "\n".join(lines)
 
 
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> JSONResponse:
+    return JSONResponse(metrics.snapshot())
+
+
+def retrain(collection: str | None) -> None:
+    """Retrain the PQ codebooks from the current vectors. Run with the server stopped:
+    a running server keeps using the codebooks it started with."""
+    if not isinstance(vector_index, PqIndex):
+        raise SystemExit("retrain needs VECTOR_SEARCH = 'pq'")
+    init_db()
+    try:
+        retrained = writer.run(lambda db: vector_index.retrain(db, collection))
+    finally:
+        writer.close()
+        db_pool.close()
+    for scope, count in retrained.items():
+        print(f"Retrained {scope or 'all collections'!r}: {count:,} vectors")
+
+
 def main():
-    mcp.run(transport="http", host="0.0.0.0", port=9005)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="engram MCP server")
+    subcommands = parser.add_subparsers(dest="command")
+    retrain_parser = subcommands.add_parser("retrain", help="retrain the PQ codebooks (VECTOR_SEARCH = 'pq')")
+    retrain_parser.add_argument("collection", nargs="?", help="only this collection (with PQ_PER_COLLECTION)")
+    args = parser.parse_args()
+    if args.command == "retrain":
+        retrain(args.collection)
+        return
+
+    init_db()
+    try:
+        mcp.run(transport="http", host="0.0.0.0", port=9005)
+    finally:
+        writer.close()
+        vector_index.persist()
+        db_pool.close()
+        search_executor.shutdown()
+        embedding_client.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds (ms) of the latency histogram buckets kept for every timing
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Timing:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect.bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "avg_ms": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+            "histogram": {
+                f"le_{bound}ms" if bound else "inf": n
+                for bound, n in zip((*BUCKETS_MS, None), self.buckets)
+                if n
+            },
+        }
+
+
+class Summary:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 3) if self.count else 0.0,
+            "max": self.max,
+        }
+
+
+class Metrics:
+    """Thread-safe counters and timings, served as JSON at /metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, int] = {}
+        self._timings: dict[str, Timing] = {}
+        self._gauges: dict[str, float] = {}
+        self._values: dict[str, Summary] = {}
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def set(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def record(self, name: str, value: float) -> None:
+        """Track the distribution of a non-time quantity (batch sizes, k, ...)."""
+        with self._lock:
+            summary = self._values.get(name)
+            if summary is None:
+                summary = self._values[name] = Summary()
+            summary.record(value)
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = Timing()
+            timing.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(sorted(self._counters.items())),
+                "gauges": dict(sorted(self._gauges.items())),
+                "timings": {name: t.snapshot() for name, t in sorted(self._timings.items())},
+                "values": {name: v.snapshot() for name, v in sorted(self._values.items())},
+            }
@@ -0,0 +1,384 @@
+import logging
+import sqlite3
+from collections.abc import Callable
+
+from embeddings import text_hash
+
+log = logging.getLogger("engram.schema")
+
+
+def _v1_initial(db: sqlite3.Connection, embed_dims: int) -> None:
+    # Databases created before migrations existed already have these tables
+    # at user_version 0, hence IF NOT EXISTS.
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS memories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            collection TEXT NOT NULL,
+            text TEXT NOT NULL,
+            created_at TEXT DEFAULT (datetime('now'))
+        )
+    """)
+    db.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS memory_vecs USING vec0(
+            embedding FLOAT[{embed_dims}]
+        )
+    """)
+    db.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS memory_fts USING fts5(
+            text,
+            tokenize='porter ascii'
+        )
+    """)
+    # Populate FTS for any memories saved before the FTS index existed
+    db.execute("""
+        INSERT INTO memory_fts(rowid, text)
+        SELECT id, text FROM memories
+        WHERE id NOT IN (SELECT rowid FROM memory_fts)
+    """)
+
+
+def _v2_embedding_cache(db: sqlite3.Connection, embed_dims: int) -> None:
+    db.execute("""
+        CREATE TABLE embedding_cache (
+            model TEXT NOT NULL,
+            text_hash BLOB NOT NULL,
+            embedding BLOB NOT NULL,
+            PRIMARY KEY (model, text_hash)
+        ) WITHOUT ROWID
+    """)
+
+
+def _v3_partition_vectors(db: sqlite3.Connection, embed_dims: int) -> None:
+    # Rebuild memory_vecs with the collection as a vec0 partition key so KNN
+    # queries only scan the target collection. vec0 tables can't be renamed,
+    # so stage the vectors in a plain table and copy them back.
+    db.execute("""
+        CREATE TABLE memory_vecs_staging AS
+        SELECT v.rowid AS id, m.collection AS collection, v.embedding AS embedding
+        FROM memory_vecs v
+        JOIN memories m ON m.id = v.rowid
+    """)
+    db.execute("DROP TABLE memory_vecs")
+    db.execute(f"""
+        CREATE VIRTUAL TABLE memory_vecs USING vec0(
+            collection TEXT PARTITION KEY,
+            embedding FLOAT[{embed_dims}]
+        )
+    """)
+    db.execute("""
+        INSERT INTO memory_vecs(rowid, collection, embedding)
+        SELECT id, collection, embedding FROM memory_vecs_staging ORDER BY id
+    """)
+    db.execute("DROP TABLE memory_vecs_staging")
+
+
+def _v4_collection_fts(db: sqlite3.Connection, embed_dims: int) -> None:
+    # Index the collection alongside the text so a MATCH can be restricted to
+    # one collection's postings. The collection column only filters; it
+    # carries no weight in the ranking.
+    db.execute("""
+        CREATE VIRTUAL TABLE memory_fts_v4 USING fts5(
+            collection,
+            text,
+            tokenize='porter ascii'
+        )
+    """)
+    db.execute("INSERT INTO memory_fts_v4(memory_fts_v4, rank) VALUES ('rank', 'bm25(0.0, 1.0)')")
+    db.execute("""
+        INSERT INTO memory_fts_v4(rowid, collection, text)
+        SELECT id, collection, text FROM memories ORDER BY id
+    """)
+    db.execute("DROP TABLE memory_fts")
+    db.execute("ALTER TABLE memory_fts_v4 RENAME TO memory_fts")
+
+
+def _table_bytes(db: sqlite3.Connection, table: str) -> int:
+    try:
+        return db.execute(
+            "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = ?", [table]
+        ).fetchone()[0]
+    except sqlite3.OperationalError:
+        # SQLite built without dbstat; count the stored values instead
+        return db.execute(
+            f"SELECT COALESCE(SUM(LENGTH(CAST(c0 AS BLOB)) + LENGTH(CAST(c1 AS BLOB))), 0) FROM {table}"
+        ).fetchone()[0]
+
+
+def _v5_external_content_fts(db: sqlite3.Connection, embed_dims: int) -> None:
+    # Stop keeping a second copy of every memory's text in memory_fts_content:
+    # the index reads collection and text straight from memories, and triggers
+    # keep it in sync with every insert, update and delete.
+    saved = _table_bytes(db, "memory_fts_content")
+    db.execute("""
+        CREATE VIRTUAL TABLE memory_fts_v5 USING fts5(
+            collection,
+            text,
+            content='memories',
+            content_rowid='id',
+            tokenize='porter ascii'
+        )
+    """)
+    db.execute("INSERT INTO memory_fts_v5(memory_fts_v5, rank) VALUES ('rank', 'bm25(0.0, 1.0)')")
+    db.execute("INSERT INTO memory_fts_v5(memory_fts_v5) VALUES ('rebuild')")
+    db.execute("DROP TABLE memory_fts")
+    db.execute("ALTER TABLE memory_fts_v5 RENAME TO memory_fts")
+    db.execute("""
+        CREATE TRIGGER memories_fts_insert AFTER INSERT ON memories BEGIN
+            INSERT INTO memory_fts(rowid, collection, text)
+            VALUES (new.id, new.collection, new.text);
+        END
+    """)
+    db.execute("""
+        CREATE TRIGGER memories_fts_delete AFTER DELETE ON memories BEGIN
+            INSERT INTO memory_fts(memory_fts, rowid, collection, text)
+            VALUES ('delete', old.id, old.collection, old.text);
+        END
+    """)
+    db.execute("""
+        CREATE TRIGGER memories_fts_update AFTER UPDATE OF collection, text ON memories BEGIN
+            INSERT INTO memory_fts(memory_fts, rowid, collection, text)
+            VALUES ('delete', old.id, old.collection, old.text);
+            INSERT INTO memory_fts(rowid, collection, text)
+            VALUES (new.id, new.collection, new.text);
+        END
+    """)
+    log.info(
+        "memory_fts now reads text from memories: %s bytes of duplicated text freed "
+        "(reused for new data; VACUUM to shrink the file)", f"{saved:,}"
+    )
+
+
+def _v6_collection_created_index(db: sqlite3.Connection, embed_dims: int) -> None:
+    # Serves randomly_remember's newest/oldest scans and list_collections'
+    # per-collection MAX(created_at) straight from the index, without sorting
+    db.execute("CREATE INDEX memories_collection_created ON memories(collection, created_at)")
+
+
+def _v7_collection_stats(db: sqlite3.Connection, embed_dims: int) -> None:
+    # Per-collection totals so list_collections and search never aggregate
+    # over memories. Triggers keep the memory counts, text sizes and dates
+    # current; vector_count is maintained by the write path, since vec0
+    # tables can't carry triggers. Deletes don't roll first_created or
+    # last_updated back.
+    db.execute("""
+        CREATE TABLE collections (
+            name TEXT PRIMARY KEY,
+            memory_count INTEGER NOT NULL DEFAULT 0,
+            text_bytes INTEGER NOT NULL DEFAULT 0,
+            vector_count INTEGER NOT NULL DEFAULT 0,
+            first_created TEXT,
+            last_updated TEXT
+        ) WITHOUT ROWID
+    """)
+    db.execute("""
+        INSERT INTO collections(name, memory_count, text_bytes, first_created, last_updated)
+        SELECT collection, COUNT(*), SUM(LENGTH(CAST(text AS BLOB))), MIN(created_at), MAX(created_at)
+        FROM memories
+        GROUP BY collection
+    """)
+    db.executemany(
+        "UPDATE collections SET vector_count = ? WHERE name = ?",
+        [(count, name) for name, count in db.execute(
+            "SELECT collection, COUNT(*) FROM memory_vecs GROUP BY collection"
+        ).fetchall()]
+    )
+    db.execute("""
+        CREATE TRIGGER memories_collection_insert AFTER INSERT ON memories BEGIN
+            INSERT INTO collections(name, memory_count, text_bytes, first_created, last_updated)
+            VALUES (new.collection, 1, LENGTH(CAST(new.text AS BLOB)), new.created_at, new.created_at)
+            ON CONFLICT(name) DO UPDATE SET
+                memory_count = memory_count + 1,
+                text_bytes = text_bytes + excluded.text_bytes,
+                first_created = MIN(COALESCE(first_created, excluded.first_created), excluded.first_created),
+                last_updated = MAX(COALESCE(last_updated, excluded.last_updated), excluded.last_updated);
+        END
+    """)
+    db.execute("""
+        CREATE TRIGGER memories_collection_delete AFTER DELETE ON memories BEGIN
+            UPDATE collections SET
+                memory_count = memory_count - 1,
+                text_bytes = text_bytes - LENGTH(CAST(old.text AS BLOB))
+            WHERE name = old.collection;
+        END
+    """)
+    db.execute("""
+        CREATE TRIGGER memories_collection_update AFTER UPDATE OF collection, text ON memories BEGIN
+            UPDATE collections SET
+                memory_count = memory_count - 1,
+                text_bytes = text_bytes - LENGTH(CAST(old.text AS BLOB))
+            WHERE name = old.collection;
+            INSERT INTO collections(name, memory_count, text_bytes, first_created, last_updated)
+            VALUES (new.collection, 1, LENGTH(CAST(new.text AS BLOB)), new.created_at, new.created_at)
+            ON CONFLICT(name) DO UPDATE SET
+                memory_count = memory_count + 1,
+                text_bytes = text_bytes + excluded.text_bytes,
+                first_created = MIN(COALESCE(first_created, excluded.first_created), excluded.first_created),
+                last_updated = MAX(COALESCE(last_updated, excluded.last_updated), excluded.last_updated);
+        END
+    """)
+
+
+def _v8_collection_seq(db: sqlite3.Connection, embed_dims: int) -> None:
+    # Number each collection's memories 1, 2, 3, ... so a uniformly random
+    # memory is one index seek on (collection, seq) for a random seq between
+    # 1 and collections.max_seq. Deleted memories leave holes in the numbering.
+    db.execute("ALTER TABLE memories ADD COLUMN seq INTEGER")
+    db.execute("ALTER TABLE collections ADD COLUMN max_seq INTEGER NOT NULL DEFAULT 0")
+    db.execute("""
+        UPDATE memories SET seq = numbered.seq
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY collection ORDER BY id) AS seq
+            FROM memories
+        ) AS numbered
+        WHERE memories.id = numbered.id
+    """)
+    db.execute("""
+        UPDATE collections SET max_seq = (
+            SELECT COALESCE(MAX(seq), 0) FROM memories WHERE collection = collections.name
+        )
+    """)
+    db.execute("CREATE UNIQUE INDEX memories_collection_seq ON memories(collection, seq)")
+    db.execute("DROP TRIGGER memories_collection_insert")
+    db.execute("DROP TRIGGER memories_collection_update")
+    db.execute("""
+        CREATE TRIGGER memories_collection_insert AFTER INSERT ON memories BEGIN
+            INSERT INTO collections(name, memory_count, text_bytes, max_seq, first_created, last_updated)
+            VALUES (new.collection, 1, LENGTH(CAST(new.text AS BLOB)), 1, new.created_at, new.created_at)
+            ON CONFLICT(name) DO UPDATE SET
+                memory_count = memory_count + 1,
+                text_bytes = text_bytes + excluded.text_bytes,
+                max_seq = max_seq + 1,
+                first_created = MIN(COALESCE(first_created, excluded.first_created), excluded.first_created),
+                last_updated = MAX(COALESCE(last_updated, excluded.last_updated), excluded.last_updated);
+            UPDATE memories
+            SET seq = (SELECT max_seq FROM collections WHERE name = new.collection)
+            WHERE id = new.id;
+        END
+    """)
+    db.execute("""
+        CREATE TRIGGER memories_collection_update AFTER UPDATE OF collection, text ON memories BEGIN
+            UPDATE collections SET
+                memory_count = memory_count - 1,
+                text_bytes = text_bytes - LENGTH(CAST(old.text AS BLOB))
+            WHERE name = old.collection;
+            INSERT INTO collections(name, memory_count, text_bytes, max_seq, first_created, last_updated)
+            VALUES (new.collection, 1, LENGTH(CAST(new.text AS BLOB)), 1, new.created_at, new.created_at)
+            ON CONFLICT(name) DO UPDATE SET
+                memory_count = memory_count + 1,
+                text_bytes = text_bytes + excluded.text_bytes,
+                max_seq = max_seq + (new.collection != old.collection),
+                first_created = MIN(COALESCE(first_created, excluded.first_created), excluded.first_created),
+                last_updated = MAX(COALESCE(last_updated, excluded.last_updated), excluded.last_updated);
+            UPDATE memories
+            SET seq = (SELECT max_seq FROM collections WHERE name = new.collection)
+            WHERE id = new.id AND new.collection != old.collection;
+        END
+    """)
+
+
+def _v9_vector_indexes(db: sqlite3.Connection, embed_dims: int) -> None:
+    # Optional secondary vector indexes (quantized copies and the like) are
+    # built from memory_vecs when first enabled; this records how far each
+    # has caught up so re-enabling one only has to index newer memories.
+    db.execute("""
+        CREATE TABLE vector_indexes (
+            name TEXT PRIMARY KEY,
+            synced_id INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+
+
+def _v10_embedding_cache_refs(db: sqlite3.Connection, embed_dims: int) -> None:
+    # Saved memories' embeddings were being cached a second time, in full, next
+    # to their memory_vecs rows. Only search queries keep a blob now, with an
+    # age to prune by; a saved text's row just points at its memory_vecs row.
+    db.execute("""
+        CREATE TABLE embedding_cache_v10 (
+            model TEXT NOT NULL,
+            text_hash BLOB NOT NULL,
+            embedding BLOB,
+            memory_id INTEGER,
+            created_at TEXT DEFAULT (datetime('now')),
+            PRIMARY KEY (model, text_hash)
+        ) WITHOUT ROWID
+    """)
+    db.execute("""
+        INSERT INTO embedding_cache_v10(model, text_hash, embedding)
+        SELECT model, text_hash, embedding FROM embedding_cache
+    """)
+    db.execute("DROP TABLE embedding_cache")
+    db.execute("ALTER TABLE embedding_cache_v10 RENAME TO embedding_cache")
+    db.execute("CREATE INDEX embedding_cache_created ON embedding_cache(created_at) WHERE embedding IS NOT NULL")
+    # A cached blob identical to a memory's vector came from saving that memory
+    models = [model for model, in db.execute("SELECT DISTINCT model FROM embedding_cache").fetchall()]
+    refs = []
+    for memory_id, text in db.execute("SELECT id, text FROM memories"):
+        vector = db.execute("SELECT embedding FROM memory_vecs WHERE rowid = ?", [memory_id]).fetchone()
+        if vector is None:
+            continue
+        hash = text_hash(text)
+        for model in models:
+            key = (model, hash)
+            row = db.execute(
+                "SELECT embedding FROM embedding_cache WHERE model = ? AND text_hash = ?", key
+            ).fetchone()
+            if row is not None and row[0] == vector[0]:
+                refs.append((memory_id, *key))
+    db.executemany(
+        "UPDATE embedding_cache SET embedding = NULL, memory_id = ? WHERE model = ? AND text_hash = ?", refs
+    )
+    log.info(
+        "embedding_cache now points at memory_vecs for %s saved memories "
+        "(space is reused for new data; VACUUM to shrink the file)", f"{len(refs):,}"
+    )
+
+
+# Append only: a migration's position in this list is its schema version.
+MIGRATIONS: list[Callable[[sqlite3.Connection, int], None]] = [
+    _v1_initial,
+    _v2_embedding_cache,
+    _v3_partition_vectors,
+    _v4_collection_fts,
+    _v5_external_content_fts,
+    _v6_collection_created_index,
+    _v7_collection_stats,
+    _v8_collection_seq,
+    _v9_vector_indexes,
+    _v10_embedding_cache_refs,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(db: sqlite3.Connection) -> int:
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db: sqlite3.Connection, embed_dims: int) -> int:
+    """Bring the database up to SCHEMA_VERSION, one transaction per migration.
+
+    Returns the resulting schema version. Does nothing (beyond reading
+    user_version) when the schema is already current.
+    """
+    version = schema_version(db)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema v{version} is newer than this engram (v{SCHEMA_VERSION})"
+        )
+    while version < SCHEMA_VERSION:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock
+            version = schema_version(db)
+            if version >= SCHEMA_VERSION:
+                db.rollback()
+                break
+            MIGRATIONS[version](db, embed_dims)
+            version += 1
+            db.execute(f"PRAGMA user_version = {version}")
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        log.info("Migrated schema to v%d (%s)", version, MIGRATIONS[version - 1].__name__)
+    return version
@@ -0,0 +1,39 @@
+import math
+from collections.abc import Callable
+from typing import TypeVar
+
+from metrics import Metrics
+
+T = TypeVar("T")
+
+
+def adaptive_fetch(
+    fetch: Callable[[int], tuple[list[T], int]],
+    want: int,
+    *,
+    selectivity: float,
+    cap: int,
+    metrics: Metrics,
+    name: str,
+    growth: int = 4,
+) -> list[T]:
+    """Run a top-k query whose results are filtered afterwards, sizing k to the filter.
+
+    `fetch(k)` runs the query with limit k and returns the results that survived
+    filtering plus how many rows the query produced before filtering.
+    `selectivity` is the expected surviving fraction, e.g. the collection's
+    share of all rows, and sets the first k; if too few ids survive, k grows
+    by `growth` until enough do, the query runs dry, or k hits `cap`. The
+    number of rounds and the final k are recorded under `name`.
+    """
+    k = min(cap, max(want, math.ceil(want / max(selectivity, 1 / cap))))
+    rounds = 0
+    while True:
+        rounds += 1
+        ids, produced = fetch(k)
+        if len(ids) >= want or produced < k or k >= cap:
+            break
+        k = min(cap, k * growth)
+    metrics.record(f"{name}.rounds", rounds)
+    metrics.record(f"{name}.final_k", k)
+    return ids[:want]
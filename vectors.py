@@ -0,0 +1,1349 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import sqlite3
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import AbstractContextManager, contextmanager
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+from sqlite_vec import serialize_float32
+
+from metrics import Metrics
+from search import adaptive_fetch
+
+log = logging.getLogger("engram.vectors")
+
+# (id, embedding) pairs
+Rows = list[tuple[int, list[float]]]
+
+
+def exact_distances(db: sqlite3.Connection, embedding: bytes, ids: list[int]) -> list[tuple[int, float]]:
+    """L2 distances from embedding to the memory_vecs rows in ids, nearest first.
+
+    One rowid lookup per id: vec0 answers `rowid = ?` directly but turns
+    `rowid IN (...)` into a full scan.
+    """
+    distances = []
+    for id in ids:
+        row = db.execute(
+            "SELECT vec_distance_l2(embedding, ?) FROM memory_vecs WHERE rowid = ?",
+            [embedding, id]
+        ).fetchone()
+        if row is not None:
+            distances.append((id, row[0]))
+    distances.sort(key=lambda item: item[1])
+    return distances
+
+
+def synced_id(db: sqlite3.Connection, name: str) -> int:
+    row = db.execute("SELECT synced_id FROM vector_indexes WHERE name = ?", [name]).fetchone()
+    return row[0] if row else 0
+
+
+def mark_synced(db: sqlite3.Connection, name: str, id: int) -> None:
+    db.execute("""
+        INSERT INTO vector_indexes(name, synced_id) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET synced_id = MAX(synced_id, excluded.synced_id)
+    """, [name, id])
+
+
+class VectorIndex(ABC):
+    """A way of finding a collection's nearest vectors.
+
+    memory_vecs always holds every vector and stays the source of truth; an
+    index is kept in step with it through these hooks:
+
+    - sync(db) runs once on the writer at startup and catches up with
+      anything saved while the index wasn't being maintained.
+    - stage(db, ...) runs inside the transaction that saves the rows, for
+      indexes stored in the database itself.
+    - add() / remove() run once the change has committed, for indexes held
+      in memory.
+    - persist() saves an in-memory index to disk, at shutdown.
+
+    nearest() may return None when it can't answer for a collection, and the
+    caller then falls back to an exact search.
+    """
+
+    name: str
+
+    def sync(self, db: sqlite3.Connection) -> int:
+        """Catch up with memory_vecs; returns how many vectors were added."""
+        return 0
+
+    def stage(self, db: sqlite3.Connection, collection: str, rows: Rows) -> None:
+        pass
+
+    def add(self, collection: str, rows: Rows) -> None:
+        pass
+
+    def remove(self, collection: str, ids: list[int]) -> None:
+        pass
+
+    @abstractmethod
+    def nearest(
+        self, db: sqlite3.Connection, collection: str, embedding: list[float], k: int
+    ) -> list[tuple[int, float]] | None:
+        """(id, L2 distance) of the k nearest memories in collection, nearest
+        first. Engines that only rank approximately may return approximate
+        distances."""
+
+    def search(self, db: sqlite3.Connection, collection: str, embedding: list[float], k: int) -> list[int] | None:
+        """Ids of the k nearest memories in collection, best first."""
+        hits = self.nearest(db, collection, embedding, k)
+        return None if hits is None else [id for id, _ in hits]
+
+    def distances(
+        self, db: sqlite3.Connection, collection: str, embedding: list[float], ids: list[int]
+    ) -> list[tuple[int, float]]:
+        """Exact L2 distances to the given memories, nearest first, skipping
+        ids with no vector. Costs one lookup per id, whatever the collection's
+        size."""
+        return exact_distances(db, serialize_float32(embedding), ids)
+
+    def persist(self) -> None:
+        pass
+
+
+class SqliteVecIndex(VectorIndex):
+    """Exact KNN over memory_vecs itself, within the collection's partition."""
+
+    name = "memory_vecs"
+
+    def __init__(self, *, metrics: Metrics, max_k: int = 4096):
+        self.max_k = max_k
+        self._metrics = metrics
+
+    def nearest(
+        self, db: sqlite3.Connection, collection: str, embedding: list[float], k: int
+    ) -> list[tuple[int, float]]:
+        blob = serialize_float32(embedding)
+
+        # Partitioned, so nothing gets filtered out
+        def fetch(k: int) -> tuple[list[tuple[int, float]], int]:
+            hits = db.execute("""
+                SELECT rowid, distance
+                FROM memory_vecs
+                WHERE embedding MATCH ?
+                  AND k = ?
+                  AND collection = ?
+                ORDER BY distance
+            """, [blob, k, collection]).fetchall()
+            return hits, len(hits)
+
+        return adaptive_fetch(
+            fetch, k, selectivity=1.0, cap=self.max_k, metrics=self._metrics, name="search.vec"
+        )
+
+
+class CoarseIndex(VectorIndex):
+    """A cheaper copy of memory_vecs in its own vec0 table, for a first-pass KNN.
+
+    nearest() over-fetches `oversample` candidates per wanted result from the
+    copy and rescores them exactly against the float32 vectors in
+    memory_vecs. Subclasses define the column type and how an embedding is
+    encoded for it.
+    """
+
+    name: str
+    column: str
+    placeholder = "?"
+
+    def __init__(self, *, oversample: int, metrics: Metrics, max_k: int = 4096):
+        self.oversample = oversample
+        self.max_k = max_k
+        self._metrics = metrics
+
+    @property
+    @abstractmethod
+    def bytes_per_vector(self) -> int:
+        """Size of one encoded vector in the copy."""
+
+    @abstractmethod
+    def _encode(self, collection: str, embedding: list[float]) -> bytes:
+        """Encode an embedding for the copy's column."""
+
+    def _encode_blob(self, collection: str, blob: bytes) -> bytes:
+        """Encode a float32 blob read back from memory_vecs."""
+        return self._encode(collection, struct.unpack(f"{len(blob) // 4}f", blob))
+
+    def _encode_query(self, collection: str, embedding: list[float]) -> bytes:
+        """Encode a query embedding for the first-pass KNN."""
+        return self._encode(collection, embedding)
+
+    def _accepts(self, collection: str) -> bool:
+        """Whether the collection's vectors go in this index at all."""
+        return True
+
+    def create(self, db: sqlite3.Connection) -> None:
+        db.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {self.name} USING vec0(
+                collection TEXT PARTITION KEY,
+                embedding {self.column}
+            )
+        """)
+
+    def stage(self, db: sqlite3.Connection, collection: str, rows: Rows) -> None:
+        # remove() is left a no-op: rows whose memory_vecs row is gone drop
+        # out when candidates are rescored
+        if not rows or not self._accepts(collection):
+            return
+        db.executemany(
+            f"INSERT INTO {self.name}(rowid, collection, embedding) VALUES (?, ?, {self.placeholder})",
+            [(id, collection, self._encode(collection, embedding)) for id, embedding in rows]
+        )
+        mark_synced(db, self.name, max(id for id, _ in rows))
+
+    def sync(self, db: sqlite3.Connection, batch_size: int = 1000) -> int:
+        """Create the index if needed and add every memory_vecs row it's missing."""
+        self.create(db)
+        last = synced_id(db, self.name)
+        added = 0
+        cursor = db.execute("""
+            SELECT rowid, collection, embedding FROM memory_vecs
+            WHERE rowid > ?
+            ORDER BY rowid
+        """, [last])
+        while rows := cursor.fetchmany(batch_size):
+            encoded = [
+                (id, collection, self._encode_blob(collection, blob))
+                for id, collection, blob in rows if self._accepts(collection)
+            ]
+            db.executemany(
+                f"INSERT INTO {self.name}(rowid, collection, embedding) VALUES (?, ?, {self.placeholder})",
+                encoded
+            )
+            last = rows[-1][0]
+            added += len(encoded)
+        mark_synced(db, self.name, last)
+        return added
+
+    def nearest(
+        self, db: sqlite3.Connection, collection: str, embedding: list[float], k: int
+    ) -> list[tuple[int, float]]:
+        candidates = [id for (id,) in db.execute(f"""
+            SELECT rowid
+            FROM {self.name}
+            WHERE embedding MATCH {self.placeholder}
+              AND k = ?
+              AND collection = ?
+            ORDER BY distance
+        """, [self._encode_query(collection, embedding), min(k * self.oversample, self.max_k), collection])]
+        self._metrics.record(f"search.{self.name}.candidates", len(candidates))
+        return exact_distances(db, serialize_float32(embedding), candidates)[:k]
+
+
+class QuantizedIndex(CoarseIndex):
+    """A bit[] or int8[] copy of memory_vecs.
+
+    Candidates are found by hamming distance for bit and L2 for int8. At 1024
+    dims a bit vector is 128 bytes and an int8 vector 1 KB, against 4 KB of
+    float32.
+    """
+
+    def __init__(self, kind: str, dims: int, *, oversample: int, metrics: Metrics, max_k: int = 4096):
+        if kind not in ("bit", "int8"):
+            raise ValueError(f"Unknown quantization: {kind}")
+        super().__init__(oversample=oversample, metrics=metrics, max_k=max_k)
+        self.kind = kind
+        self.dims = dims
+        self.name = f"memory_vecs_{kind}"
+        self.column = f"{kind.upper()}[{dims}]"
+        # bit vectors are quantized by sqlite-vec itself from the float32 blob
+        self.placeholder = "vec_quantize_binary(?)" if kind == "bit" else "vec_int8(?)"
+        # Unit-length embeddings have components of roughly ±1/sqrt(dims);
+        # map ±4/sqrt(dims) onto the int8 range and clip the rare outliers
+        self._int8_scale = 127 * math.sqrt(dims) / 4
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.dims // 8 if self.kind == "bit" else self.dims
+
+    def _encode(self, collection: str, embedding: list[float]) -> bytes:
+        if self.kind == "bit":
+            return serialize_float32(embedding)
+        scale = self._int8_scale
+        return struct.pack(
+            f"{len(embedding)}b", *(max(-127, min(127, round(x * scale))) for x in embedding)
+        )
+
+    def _encode_blob(self, collection: str, blob: bytes) -> bytes:
+        return blob if self.kind == "bit" else super()._encode_blob(collection, blob)
+
+
+class TruncatedIndex(CoarseIndex):
+    """The first `dims` components of each vector, renormalized to unit length.
+
+    Matryoshka-trained models (snowflake-arctic-embed-l-v2.0 among them)
+    front-load their embeddings, so a short prefix ranks nearly as well as
+    the full vector at a fraction of the cost.
+    """
+
+    def __init__(self, dims: int, *, oversample: int, metrics: Metrics, max_k: int = 4096):
+        super().__init__(oversample=oversample, metrics=metrics, max_k=max_k)
+        self.dims = dims
+        self.name = f"memory_vecs_{dims}d"
+        self.column = f"FLOAT[{dims}]"
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.dims * 4
+
+    def _encode(self, collection: str, embedding: list[float]) -> bytes:
+        prefix = embedding[:self.dims]
+        norm = math.sqrt(sum(x * x for x in prefix)) or 1.0
+        return serialize_float32([x / norm for x in prefix])
+
+
+class Projection(NamedTuple):
+    mean: np.ndarray        # (full dims,)
+    components: np.ndarray  # (full dims, reduced dims), orthonormal columns
+    fitted_on: int          # collection size when fitted
+    explained: float        # share of the sample's variance the components keep
+
+    def apply(self, vectors: np.ndarray) -> np.ndarray:
+        return ((vectors - self.mean) @ self.components).astype(np.float32)
+
+
+def fit_pca(vectors: np.ndarray, dims: int, fitted_on: int) -> Projection:
+    mean = vectors.mean(axis=0)
+    centered = vectors - mean
+    # Eigenvectors of the covariance matrix, largest eigenvalues first
+    values, eigenvectors = np.linalg.eigh(centered.T @ centered)
+    order = np.argsort(values)[::-1][:dims]
+    explained = float(values[order].sum() / max(values.sum(), 1e-12))
+    return Projection(mean.astype(np.float32), eigenvectors[:, order].astype(np.float32), fitted_on, explained)
+
+
+class PcaIndex(CoarseIndex):
+    """Vectors projected onto each collection's own top `dims` principal components.
+
+    Memories in one collection tend to occupy a small subspace of the
+    embedding space, so a per-collection PCA keeps most of the distances
+    that matter in far fewer dimensions. Queries are projected with the
+    collection's projection before the first-pass KNN.
+
+    A collection gets a projection once it holds `min_fit` vectors and is
+    refitted, in the background, each time it grows by `refit_growth`x. A
+    refit re-projects the collection's vectors in one writer job, and
+    searches switch to the new projection once that has committed; saves
+    later in the same transaction are already projected the new way.
+    Searches that straddle the switch may briefly lose recall, never
+    correctness, since candidates are rescored exactly. Collections without
+    a projection are searched exactly.
+
+    Latency is timed per collection as search.pca.<collection>, and a
+    `recall_sample` share of searches also runs exactly to record
+    search.pca.<collection>.recall.
+    """
+
+    def __init__(
+        self,
+        dims: int,
+        *,
+        oversample: int,
+        min_fit: int,
+        refit_growth: float,
+        fit_sample: int,
+        recall_sample: float,
+        read: Callable[[], AbstractContextManager[sqlite3.Connection]],
+        write: Callable[..., Future],
+        metrics: Metrics,
+        max_k: int = 4096,
+    ):
+        super().__init__(oversample=oversample, metrics=metrics, max_k=max_k)
+        self.dims = dims
+        self.name = f"memory_vecs_pca{dims}"
+        self.column = f"FLOAT[{dims}]"
+        self.min_fit = max(min_fit, dims)
+        self.refit_growth = refit_growth
+        self.fit_sample = fit_sample
+        self.recall_sample = recall_sample
+        self._read = read
+        self._write = write
+        # What searches use, and what the writer projects new rows with: they
+        # differ while a refit's transaction is open
+        self._projections: dict[str, Projection] = {}
+        self._staged: dict[str, Projection] = {}
+        self._lock = threading.Lock()
+        self._sizes: dict[str, int] = {}
+        self._refitting: set[str] = set()
+        self._refitter = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pca-refit")
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.dims * 4
+
+    def projection(self, collection: str) -> Projection | None:
+        return self._projections.get(collection)
+
+    def _accepts(self, collection: str) -> bool:
+        return collection in self._staged
+
+    def _encode(self, collection: str, embedding: list[float]) -> bytes:
+        return self._staged[collection].apply(np.asarray(embedding, dtype=np.float32)).tobytes()
+
+    def _encode_blob(self, collection: str, blob: bytes) -> bytes:
+        return self._staged[collection].apply(np.frombuffer(blob, dtype=np.float32)).tobytes()
+
+    def _encode_query(self, collection: str, embedding: list[float]) -> bytes:
+        return self._projections[collection].apply(np.asarray(embedding, dtype=np.float32)).tobytes()
+
+    def create(self, db: sqlite3.Connection) -> None:
+        super().create(db)
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS pca_projections (
+                collection TEXT NOT NULL,
+                dims INTEGER NOT NULL,
+                mean BLOB NOT NULL,
+                components BLOB NOT NULL,
+                fitted_on INTEGER NOT NULL,
+                explained REAL NOT NULL,
+                fitted_at TEXT NOT NULL DEFAULT (datetime('now')),
+                PRIMARY KEY (collection, dims)
+            ) WITHOUT ROWID
+        """)
+
+    def sync(self, db: sqlite3.Connection, batch_size: int = 1000) -> int:
+        """Load the projections, catch up the projected vectors, then fit any
+        collection that has reached min_fit or outgrown its projection."""
+        self.create(db)
+        for collection, mean, components, fitted_on, explained in db.execute(
+            "SELECT collection, mean, components, fitted_on, explained FROM pca_projections WHERE dims = ?",
+            [self.dims]
+        ):
+            self._staged[collection] = Projection(
+                np.frombuffer(mean, dtype=np.float32),
+                np.frombuffer(components, dtype=np.float32).reshape(-1, self.dims),
+                fitted_on,
+                explained,
+            )
+        added = super().sync(db, batch_size)
+        self._sizes = dict(db.execute("SELECT name, vector_count FROM collections"))
+        for collection in [c for c in self._sizes if self._needs_fit(c)]:
+            added += self._install(db, collection, self._fit(db, collection), batch_size)
+        # Before the commit, but sync runs at startup, before any search
+        self._projections.update(self._staged)
+        return added
+
+    def add(self, collection: str, rows: Rows) -> None:
+        with self._lock:
+            self._sizes[collection] = self._sizes.get(collection, 0) + len(rows)
+            if not self._needs_fit(collection) or collection in self._refitting:
+                return
+            self._refitting.add(collection)
+        self._refitter.submit(self._refit, collection)
+
+    def _needs_fit(self, collection: str) -> bool:
+        size = self._sizes.get(collection, 0)
+        projection = self._staged.get(collection)
+        if projection is None:
+            return size >= self.min_fit
+        return size >= projection.fitted_on * self.refit_growth
+
+    def _fit(self, db: sqlite3.Connection, collection: str) -> Projection:
+        start = time.perf_counter()
+        ids = [id for (id,) in db.execute("SELECT id FROM memories WHERE collection = ?", [collection])]
+        blobs = [
+            row[0] for id in random.sample(ids, min(len(ids), self.fit_sample))
+            if (row := db.execute("SELECT embedding FROM memory_vecs WHERE rowid = ?", [id]).fetchone())
+        ]
+        vectors = np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(len(blobs), -1).astype(np.float64)
+        projection = fit_pca(vectors, self.dims, len(ids))
+        self._metrics.observe(f"{self.name}.fit", time.perf_counter() - start)
+        self._metrics.set(f"search.pca.{collection}.explained", round(projection.explained, 4))
+        return projection
+
+    def _install(self, db: sqlite3.Connection, collection: str, projection: Projection, batch_size: int = 1000) -> int:
+        """Store the projection and re-project the collection's vectors with it.
+        Runs on the writer; searches keep the old projection until the caller
+        publishes this one after the commit."""
+        db.execute("""
+            INSERT OR REPLACE INTO pca_projections(collection, dims, mean, components, fitted_on, explained)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [
+            collection, self.dims, projection.mean.tobytes(), projection.components.tobytes(),
+            projection.fitted_on, projection.explained,
+        ])
+        db.execute(f"DELETE FROM {self.name} WHERE collection = ?", [collection])
+        cursor = db.execute("SELECT rowid, embedding FROM memory_vecs WHERE collection = ?", [collection])
+        count = 0
+        while rows := cursor.fetchmany(batch_size):
+            projected = projection.apply(np.frombuffer(b"".join(blob for _, blob in rows), dtype=np.float32).reshape(len(rows), -1))
+            db.executemany(
+                f"INSERT INTO {self.name}(rowid, collection, embedding) VALUES (?, ?, ?)",
+                [(id, collection, vector.tobytes()) for (id, _), vector in zip(rows, projected)]
+            )
+            count += len(rows)
+        # Last, so saves later in the same transaction are projected the new way
+        self._staged[collection] = projection
+        log.info(
+            "Fitted PCA for %r on %d vectors: %d dims keep %.1f%% of the variance",
+            collection, projection.fitted_on, self.dims, projection.explained * 100
+        )
+        return count
+
+    def _refit(self, collection: str) -> None:
+        try:
+            with self._read() as db:
+                projection = self._fit(db, collection)
+            previous = self._staged.get(collection)
+            future = self._write(lambda db: self._install(db, collection, projection))
+
+            # Only once committed: until then, readers' snapshots hold the
+            # vectors projected the old way, or none at all on a first fit
+            def publish(future: Future) -> None:
+                if future.exception() is None:
+                    self._projections[collection] = projection
+                elif self._staged.get(collection) is projection:
+                    # The job's own statements ran, but the shared COMMIT failed
+                    if previous is None:
+                        self._staged.pop(collection, None)
+                    else:
+                        self._staged[collection] = previous
+
+            future.add_done_callback(publish)
+            future.result()
+        except Exception:
+            log.exception("PCA refit of %r failed", collection)
+        finally:
+            with self._lock:
+                self._refitting.discard(collection)
+
+    def nearest(
+        self, db: sqlite3.Connection, collection: str, embedding: list[float], k: int
+    ) -> list[tuple[int, float]] | None:
+        if collection not in self._projections:
+            return None
+        with self._metrics.timer(f"search.pca.{collection}"):
+            hits = super().nearest(db, collection, embedding, k)
+        ids = [id for id, _ in hits]
+        if ids and random.random() < self.recall_sample:
+            exact = [id for (id,) in db.execute("""
+                SELECT rowid FROM memory_vecs
+                WHERE embedding MATCH ? AND k = ? AND collection = ?
+            """, [serialize_float32(embedding), len(ids), collection])]
+            self._metrics.record(f"search.pca.{collection}.recall", len(set(ids) & set(exact)) / len(exact))
+        return hits
+
+    def persist(self) -> None:
+        # Projections are already in the database; just let a running refit finish
+        self._refitter.shutdown(wait=True)
+
+
+class _Matrix:
+    """One collection's ids plus per-row arrays, with spare rows to append into.
+
+    Rows [0, n) are live. Appends write past n or into fresh, larger arrays,
+    so views of the first n rows stay valid while searched.
+    """
+
+    def __init__(self, ids: np.ndarray, columns: tuple[np.ndarray, ...]):
+        self.ids = ids
+        self.columns = columns
+        self.n = len(ids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes + sum(column.nbytes for column in self.columns)
+
+    def append(self, ids: np.ndarray, columns: tuple[np.ndarray, ...]) -> None:
+        end = self.n + len(ids)
+        if end > len(self.ids):
+            capacity = max(end, 2 * len(self.ids), 64)
+            self.ids = self._grow(self.ids, capacity)
+            self.columns = tuple(self._grow(column, capacity) for column in self.columns)
+        self.ids[self.n:end] = ids
+        for column, values in zip(self.columns, columns):
+            column[self.n:end] = values
+        self.n = end
+
+    def _grow(self, array: np.ndarray, capacity: int) -> np.ndarray:
+        grown = np.empty((capacity, *array.shape[1:]), dtype=array.dtype)
+        grown[:self.n] = array[:self.n]
+        return grown
+
+    def live(self) -> tuple[np.ndarray, ...]:
+        return self.ids[:self.n], *(column[:self.n] for column in self.columns)
+
+    def without(self, ids: list[int]) -> "_Matrix | None":
+        """A copy without ids, or None if none of them are here."""
+        live_ids, *columns = self.live()
+        keep = ~np.isin(live_ids, ids)
+        if keep.all():
+            return None
+        return _Matrix(live_ids[keep], tuple(column[keep] for column in columns))
+
+
+class _Loading:
+    def __init__(self):
+        self.done = threading.Event()
+        self.pending: Rows = []
+        self.removed: list[int] = []
+
+
+class ResidentCache(VectorIndex):
+    """Per-collection arrays kept in RAM for searching with NumPy.
+
+    A collection is loaded on its first search and then kept current by
+    add() after each committed save. Whole collections are evicted least
+    recently used first to stay under max_bytes; nearest() returns None for
+    a collection that would not fit on its own, and the caller falls back
+    to SQLite. Subclasses decide what's stored per row (`row_bytes` of it).
+    """
+
+    row_bytes: int
+
+    def __init__(self, *, max_bytes: int, metrics: Metrics, name: str):
+        self.max_bytes = max_bytes
+        self.name = name
+        self._metrics = metrics
+        self._lock = threading.Lock()
+        self._matrices: OrderedDict[str, _Matrix] = OrderedDict()
+        self._loading: dict[str, _Loading] = {}
+        self._bytes = 0
+
+    @abstractmethod
+    def _read(self, db: sqlite3.Connection, collection: str) -> tuple[np.ndarray, tuple[np.ndarray, ...]] | None:
+        """The collection's ids and columns, from the database."""
+
+    @abstractmethod
+    def _columns(self, collection: str, embeddings: np.ndarray) -> tuple[np.ndarray, ...]:
+        """Columns for newly saved float32 embeddings."""
+
+    def add(self, collection: str, rows: Rows) -> None:
+        """Append the rows if the collection is resident or loading."""
+        if not rows:
+            return
+        with self._lock:
+            loading = self._loading.get(collection)
+            if loading is not None:
+                loading.pending.extend(rows)
+                return
+            matrix = self._matrices.get(collection)
+            if matrix is not None:
+                self._append(collection, matrix, rows)
+                self._evict(keep=collection)
+
+    def remove(self, collection: str, ids: list[int]) -> None:
+        with self._lock:
+            loading = self._loading.get(collection)
+            if loading is not None:
+                loading.removed.extend(ids)
+            elif collection in self._matrices:
+                self._drop(collection, ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._matrices.clear()
+            self._bytes = 0
+            self._metrics.set(f"{self.name}.bytes", 0)
+            self._metrics.set(f"{self.name}.collections", 0)
+
+    def _drop(self, collection: str, ids: list[int]) -> None:
+        matrix = self._matrices[collection]
+        smaller = matrix.without(ids)
+        if smaller is not None:
+            self._matrices[collection] = smaller
+            self._bytes -= matrix.nbytes - smaller.nbytes
+
+    def _append(self, collection: str, matrix: _Matrix, rows: Rows) -> None:
+        ids = np.array([id for id, _ in rows], dtype=np.int64)
+        # A load that started after the commit may already have these rows
+        fresh = ~np.isin(ids, matrix.live()[0])
+        if not fresh.any():
+            return
+        before = matrix.nbytes
+        embeddings = np.array([e for _, e in rows], dtype=np.float32)[fresh]
+        matrix.append(ids[fresh], self._columns(collection, embeddings))
+        self._bytes += matrix.nbytes - before
+
+    def _get(self, db: sqlite3.Connection, collection: str) -> _Matrix | None:
+        with self._lock:
+            matrix = self._matrices.get(collection)
+            if matrix is not None:
+                self._matrices.move_to_end(collection)
+                self._metrics.incr(f"{self.name}.hits")
+                return matrix
+            loading = self._loading.get(collection)
+            if loading is None:
+                loading = self._loading[collection] = _Loading()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            loading.done.wait()
+            with self._lock:
+                return self._matrices.get(collection)
+
+        matrix = None
+        try:
+            matrix = self._load(db, collection)
+        finally:
+            with self._lock:
+                del self._loading[collection]
+                if matrix is not None:
+                    self._matrices[collection] = matrix
+                    self._bytes += matrix.nbytes
+                    if loading.pending:
+                        self._append(collection, matrix, loading.pending)
+                    if loading.removed:
+                        self._drop(collection, loading.removed)
+                        matrix = self._matrices[collection]
+                    self._evict(keep=collection)
+            loading.done.set()
+        return matrix
+
+    def _load(self, db: sqlite3.Connection, collection: str) -> _Matrix | None:
+        row = db.execute("SELECT vector_count FROM collections WHERE name = ?", [collection]).fetchone()
+        count = row[0] if row else 0
+        if count * (self.row_bytes + 8) > self.max_bytes:
+            self._metrics.incr(f"{self.name}.too_large")
+            return None
+        start = time.perf_counter()
+        loaded = self._read(db, collection)
+        if loaded is None:
+            return None
+        self._metrics.observe(f"{self.name}.load", time.perf_counter() - start)
+        self._metrics.incr(f"{self.name}.loads")
+        return _Matrix(*loaded)
+
+    def _evict(self, keep: str) -> None:
+        """Drop least recently used collections other than keep until under max_bytes. Holds the lock."""
+        while self._bytes > self.max_bytes and len(self._matrices) > 1:
+            name = next(iter(self._matrices))
+            if name == keep:
+                self._matrices.move_to_end(name)
+                continue
+            self._bytes -= self._matrices.pop(name).nbytes
+            self._metrics.incr(f"{self.name}.evictions")
+        self._metrics.set(f"{self.name}.bytes", self._bytes)
+        self._metrics.set(f"{self.name}.collections", len(self._matrices))
+
+
+def top_k(ids: np.ndarray, distances: np.ndarray, k: int) -> list[tuple[int, float]]:
+    """The k (id, distance) pairs with the smallest distances, nearest first."""
+    k = min(k, len(ids))
+    if not k:
+        return []
+    top = np.argpartition(distances, k - 1)[:k] if k < len(ids) else np.arange(len(ids))
+    top = top[np.argsort(distances[top])]
+    return list(zip(ids[top].tolist(), distances[top].tolist()))
+
+
+class ResidentIndex(ResidentCache):
+    """Exact search over per-collection float32 matrices kept in RAM.
+
+    One matrix-vector product ranks the whole collection by L2 distance,
+    the same order sqlite-vec uses.
+    """
+
+    def __init__(self, dims: int, *, max_bytes: int, metrics: Metrics, name: str = "resident"):
+        super().__init__(max_bytes=max_bytes, metrics=metrics, name=name)
+        self.dims = dims
+        self.row_bytes = dims * 4 + 4
+
+    def _columns(self, collection: str, embeddings: np.ndarray) -> tuple[np.ndarray, ...]:
+        return embeddings, np.einsum("ij,ij->i", embeddings, embeddings)
+
+    def _read(self, db: sqlite3.Connection, collection: str) -> tuple[np.ndarray, tuple[np.ndarray, ...]]:
+        rows = db.execute(
+            "SELECT rowid, embedding FROM memory_vecs WHERE collection = ?", [collection]
+        ).fetchall()
+        ids = np.array([id for id, _ in rows], dtype=np.int64)
+        vectors = np.frombuffer(b"".join(blob for _, blob in rows), dtype=np.float32).reshape(-1, self.dims).copy()
+        return ids, self._columns(collection, vectors)
+
+    def nearest(
+        self, db: sqlite3.Connection, collection: str, embedding: list[float], k: int
+    ) -> list[tuple[int, float]] | None:
+        matrix = self._get(db, collection)
+        if matrix is None:
+            return None
+        with self._lock:
+            ids, vectors, norms = matrix.live()
+        query = np.asarray(embedding, dtype=np.float32)
+        # Rank by ||v - q||^2 less the constant ||q||^2, then add it back to the winners
+        query_norm = float(query @ query)
+        return [
+            (id, math.sqrt(max(distance + query_norm, 0.0)))
+            for id, distance in top_k(ids, norms - 2 * (vectors @ query), k)
+        ]
+
+    def distances(
+        self, db: sqlite3.Connection, collection: str, embedding: list[float], ids: list[int]
+    ) -> list[tuple[int, float]]:
+        matrix = self._get(db, collection)
+        if matrix is None:
+            return super().distances(db, collection, embedding, ids)
+        with self._lock:
+            live_ids, vectors, _ = matrix.live()
+        # A vectorized membership test instead of the per-row lookups in memory_vecs
+        rows = np.flatnonzero(np.isin(live_ids, ids))
+        distances = np.linalg.norm(vectors[rows] - np.asarray(embedding, dtype=np.float32), axis=1)
+        order = np.argsort(distances, kind="stable")
+        return list(zip(live_ids[rows][order].tolist(), distances[order].tolist()))
+
+
+def nearest_centroids(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the nearest centroid for each row of x."""
+    # ||x - c||^2 less the per-row constant ||x||^2
+    return np.argmin(np.einsum("ij,ij->i", centroids, centroids) - 2 * (x @ centroids.T), axis=1)
+
+
+def kmeans(x: np.ndarray, k: int, *, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """k centroids for the rows of x (Lloyd's algorithm, random initial centroids)."""
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iterations):
+        assigned = nearest_centroids(x, centroids)
+        counts = np.bincount(assigned, minlength=k)
+        sums = np.stack([np.bincount(assigned, weights=x[:, j], minlength=k) for j in range(x.shape[1])], axis=1)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters from random points
+        centroids[~filled] = x[rng.choice(len(x), int((~filled).sum()))]
+    return centroids
+
+
+class ProductQuantizer:
+    """Splits vectors into `subvectors` equal slices and codes each slice as
+    the nearest of 256 centroids learned for it, i.e. one byte per slice."""
+
+    def __init__(self, centroids: np.ndarray):
+        self.centroids = centroids  # (subvectors, 256, dims / subvectors)
+        self.subvectors, _, self.width = centroids.shape
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, subvectors: int, *, iterations: int = 15, seed: int = 0) -> "ProductQuantizer":
+        rng = np.random.default_rng(seed)
+        width = vectors.shape[1] // subvectors
+        return cls(np.stack([
+            kmeans(vectors[:, j * width:(j + 1) * width], 256, iterations=iterations, rng=rng)
+            for j in range(subvectors)
+        ]).astype(np.float32))
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(vectors), self.subvectors), dtype=np.uint8)
+        for j in range(self.subvectors):
+            codes[:, j] = nearest_centroids(vectors[:, j * self.width:(j + 1) * self.width], self.centroids[j])
+        return codes
+
+    def distances(self, query: np.ndarray, codes: np.ndarray, chunk: int = 16384) -> np.ndarray:
+        """Approximate squared L2 distances from query to each coded vector:
+        one (subvectors x 256) lookup table per query, then a gather and sum
+        per code."""
+        table = ((self.centroids - query.reshape(self.subvectors, 1, self.width)) ** 2).sum(axis=2).ravel()
+        offsets = np.arange(self.subvectors) * 256
+        distances = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), chunk):
+            distances[start:start + chunk] = table[codes[start:start + chunk] + offsets].sum(axis=1)
+        return distances
+
+
+class PqIndex(ResidentCache):
+    """Product-quantized codes for every vector, searched in RAM with NumPy.
+
+    Each vector is stored as `subvectors` bytes in memory_pq, against
+    4 * dims bytes of float32, and resident collections hold only those
+    codes. Codebooks are trained with k-means on a sample of memory_vecs,
+    either once for the whole database or per collection, and kept in
+    pq_codebooks. A search ranks the codes by asymmetric distance (the
+    query stays float32) and, with `rerank`, rescores the best rerank x k
+    candidates exactly against memory_vecs.
+
+    Scopes with fewer than `min_train` vectors have no codebook yet, and
+    nearest() returns None for them. Training happens in sync() once a scope
+    is big enough, or on demand with retrain().
+    """
+
+    def __init__(
+        self,
+        dims: int,
+        *,
+        subvectors: int,
+        per_collection: bool,
+        rerank: int,
+        train_sample: int,
+        min_train: int,
+        max_bytes: int,
+        metrics: Metrics,
+        name: str = "pq",
+    ):
+        if dims % subvectors:
+            raise ValueError(f"PQ subvectors ({subvectors}) must divide the embedding dims ({dims})")
+        super().__init__(max_bytes=max_bytes, metrics=metrics, name=name)
+        self.dims = dims
+        self.subvectors = subvectors
+        self.per_collection = per_collection
+        self.rerank = rerank
+        self.train_sample = train_sample
+        self.min_train = max(min_train, 256)
+        self.row_bytes = subvectors
+        self._quantizers: dict[str, ProductQuantizer] = {}
+
+    def _scope(self, collection: str) -> str:
+        return collection if self.per_collection else ""
+
+    def create(self, db: sqlite3.Connection) -> None:
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS pq_codebooks (
+                scope TEXT PRIMARY KEY,  -- collection name, or '' for one codebook for all
+                centroids BLOB NOT NULL,
+                subvectors INTEGER NOT NULL,
+                trained_on INTEGER NOT NULL,
+                trained_at TEXT NOT NULL DEFAULT (datetime('now')),
+                per_collection INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        # '' is a valid collection name too, so the scope alone can't tell the
+        # shared codebook apart; tables from before per_collection read it that way
+        if "per_collection" not in [row[1] for row in db.execute("PRAGMA table_info(pq_codebooks)")]:
+            db.execute("ALTER TABLE pq_codebooks ADD COLUMN per_collection INTEGER NOT NULL DEFAULT 0")
+            db.execute("UPDATE pq_codebooks SET per_collection = scope != ''")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS memory_pq (
+                collection TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                code BLOB NOT NULL,
+                PRIMARY KEY (collection, id)
+            ) WITHOUT ROWID
+        """)
+
+    def _store_codes(self, db: sqlite3.Connection, collection_ids: list[tuple[str, int]], embeddings: np.ndarray) -> None:
+        """Encode and store rows that all share one scope."""
+        codes = self._quantizers[self._scope(collection_ids[0][0])].encode(embeddings)
+        db.executemany(
+            "INSERT OR REPLACE INTO memory_pq(collection, id, code) VALUES (?, ?, ?)",
+            [(collection, id, code.tobytes()) for (collection, id), code in zip(collection_ids, codes)]
+        )
+
+    def stage(self, db: sqlite3.Connection, collection: str, rows: Rows) -> None:
+        if not rows or self._scope(collection) not in self._quantizers:
+            return
+        self._store_codes(
+            db, [(collection, id) for id, _ in rows], np.array([e for _, e in rows], dtype=np.float32)
+        )
+        mark_synced(db, self.name, max(id for id, _ in rows))
+
+    def _columns(self, collection: str, embeddings: np.ndarray) -> tuple[np.ndarray, ...]:
+        return (self._quantizers[self._scope(collection)].encode(embeddings),)
+
+    def _read(self, db: sqlite3.Connection, collection: str) -> tuple[np.ndarray, tuple[np.ndarray, ...]]:
+        rows = db.execute("SELECT id, code FROM memory_pq WHERE collection = ?", [collection]).fetchall()
+        ids = np.array([id for id, _ in rows], dtype=np.int64)
+        codes = np.frombuffer(b"".join(code for _, code in rows), dtype=np.uint8).reshape(-1, self.subvectors).copy()
+        return ids, (codes,)
+
+    def nearest(
+        self, db: sqlite3.Connection, collection: str, embedding: list[float], k: int
+    ) -> list[tuple[int, float]] | None:
+        quantizer = self._quantizers.get(self._scope(collection))
+        if quantizer is None:
+            return None
+        matrix = self._get(db, collection)
+        if matrix is None:
+            return None
+        with self._lock:
+            ids, codes = matrix.live()
+        distances = quantizer.distances(np.asarray(embedding, dtype=np.float32), codes)
+        if not self.rerank:
+            return [(id, math.sqrt(max(distance, 0.0))) for id, distance in top_k(ids, distances, k)]
+        candidates = [id for id, _ in top_k(ids, distances, k * self.rerank)]
+        return exact_distances(db, serialize_float32(embedding), candidates)[:k]
+
+    def sync(self, db: sqlite3.Connection, batch_size: int = 1000) -> int:
+        """Load the codebooks, code rows saved since the last run, and train
+        any scope that has grown big enough to get a codebook."""
+        self.create(db)
+        codebooks = db.execute("SELECT scope, centroids, subvectors, per_collection FROM pq_codebooks").fetchall()
+        if any(subvectors != self.subvectors or per_collection != self.per_collection
+               for _, _, subvectors, per_collection in codebooks):
+            # Codes from other settings can't be mixed with new ones: start over
+            log.warning("PQ settings changed, discarding %d codebooks", len(codebooks))
+            db.execute("DELETE FROM pq_codebooks")
+            db.execute("DELETE FROM memory_pq")
+            self._quantizers.clear()
+            self.clear()
+            codebooks = []
+        for scope, centroids, subvectors, _ in codebooks:
+            self._quantizers[scope] = ProductQuantizer(
+                np.frombuffer(centroids, dtype=np.float32).reshape(subvectors, 256, -1).copy()
+            )
+        coded = self._code_since(db, synced_id(db, self.name), batch_size)
+        for scope, count in self._scope_sizes(db).items():
+            if scope not in self._quantizers and count >= self.min_train:
+                coded += self._train(db, scope, batch_size)
+        return coded
+
+    def retrain(self, db: sqlite3.Connection, collection: str | None = None, batch_size: int = 1000) -> dict[str, int]:
+        """Train new codebooks from the current vectors and re-code everything
+        under them: every scope, or just the given collection's. Returns how
+        many vectors each retrained scope holds."""
+        self.create(db)
+        if collection is not None and not self.per_collection:
+            raise ValueError("There is one codebook for all collections; retrain without a collection")
+        sizes = self._scope_sizes(db)
+        scopes = [collection] if collection is not None else list(sizes)
+        retrained = {}
+        for scope in scopes:
+            if sizes.get(scope, 0) < self.min_train:
+                log.warning("Not retraining %r: %d vectors, need %d", scope, sizes.get(scope, 0), self.min_train)
+                continue
+            retrained[scope] = self._train(db, scope, batch_size)
+        self.clear()
+        return retrained
+
+    def _scope_sizes(self, db: sqlite3.Connection) -> dict[str, int]:
+        if self.per_collection:
+            return dict(db.execute("SELECT name, vector_count FROM collections"))
+        return {"": db.execute("SELECT COALESCE(SUM(vector_count), 0) FROM collections").fetchone()[0]}
+
+    def _code_since(self, db: sqlite3.Connection, last: int, batch_size: int) -> int:
+        cursor = db.execute("""
+            SELECT rowid, collection, embedding FROM memory_vecs
+            WHERE rowid > ?
+            ORDER BY rowid
+        """, [last])
+        coded = 0
+        while rows := cursor.fetchmany(batch_size):
+            by_scope: dict[str, list[tuple[int, str, bytes]]] = {}
+            for row in rows:
+                if self._scope(row[1]) in self._quantizers:
+                    by_scope.setdefault(self._scope(row[1]), []).append(row)
+            for scope_rows in by_scope.values():
+                self._store_codes(db, [(c, id) for id, c, _ in scope_rows], self._unpack([b for _, _, b in scope_rows]))
+                coded += len(scope_rows)
+            last = rows[-1][0]
+        mark_synced(db, self.name, last)
+        return coded
+
+    def _unpack(self, blobs: list[bytes]) -> np.ndarray:
+        return np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(-1, self.dims)
+
+    def _train(self, db: sqlite3.Connection, scope: str, batch_size: int) -> int:
+        """Train the scope's codebook on a sample of its vectors, then re-code all of them."""
+        start = time.perf_counter()
+        if self.per_collection:
+            ids = [id for (id,) in db.execute("SELECT id FROM memories WHERE collection = ?", [scope])]
+        else:
+            ids = [id for (id,) in db.execute("SELECT id FROM memories")]
+        sample = random.sample(ids, min(len(ids), self.train_sample))
+        blobs = [
+            row[0] for id in sample
+            if (row := db.execute("SELECT embedding FROM memory_vecs WHERE rowid = ?", [id]).fetchone())
+        ]
+        quantizer = ProductQuantizer.train(self._unpack(blobs), self.subvectors)
+        db.execute("""
+            INSERT OR REPLACE INTO pq_codebooks(scope, centroids, subvectors, trained_on, per_collection)
+            VALUES (?, ?, ?, ?, ?)
+        """, [scope, quantizer.centroids.tobytes(), self.subvectors, len(blobs), self.per_collection])
+        self._quantizers[scope] = quantizer
+
+        if self.per_collection:
+            db.execute("DELETE FROM memory_pq WHERE collection = ?", [scope])
+            cursor = db.execute("SELECT rowid, collection, embedding FROM memory_vecs WHERE collection = ?", [scope])
+        else:
+            db.execute("DELETE FROM memory_pq")
+            cursor = db.execute("SELECT rowid, collection, embedding FROM memory_vecs")
+        coded = 0
+        while rows := cursor.fetchmany(batch_size):
+            self._store_codes(db, [(c, id) for id, c, _ in rows], self._unpack([b for _, _, b in rows]))
+            coded += len(rows)
+        self._metrics.observe(f"{self.name}.train", time.perf_counter() - start)
+        log.info("Trained PQ codebook %r on %d vectors and coded %d", scope, len(blobs), coded)
+        return coded
+
+
+class _ReadWriteLock:
+    """Any number of readers or one writer; a waiting writer holds off new readers."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class _GraphLocks:
+    """hnswlib runs queries and insertions concurrently, but not alongside
+    resize_index(), save_index() or, for a consistent live count,
+    mark_deleted(): those take `graph` for writing, everything else for
+    reading. `adding` serializes a collection's insertions so that the
+    capacity check and the insertion it sized for go together."""
+
+    def __init__(self):
+        self.graph = _ReadWriteLock()
+        self.adding = threading.Lock()
+
+
+class HnswIndex(VectorIndex):
+    """Approximate KNN over one hnswlib graph per collection.
+
+    Query time grows roughly with log(n) rather than n. The graphs live in
+    memory and are saved to `directory` by persist(), with a manifest
+    recording the highest memory id they cover; sync() loads them back and
+    adds whatever memory_vecs gained since, so a crash only costs the
+    rebuild of what wasn't saved.
+
+    Each collection's graph has its own locks (see _GraphLocks), so searches
+    don't wait on other collections or on insertions; `_lock` only guards
+    the bookkeeping dicts.
+
+    Needs the optional hnswlib package (`uv sync --extra hnsw`).
+    """
+
+    name = "hnsw"
+
+    def __init__(
+        self,
+        dims: int,
+        directory: Path,
+        *,
+        metrics: Metrics,
+        m: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 64,
+    ):
+        try:
+            import hnswlib
+        except ImportError:
+            raise RuntimeError("VECTOR_SEARCH = 'hnsw' needs hnswlib: uv sync --extra hnsw") from None
+        self._hnswlib = hnswlib
+        self.dims = dims
+        self.directory = directory
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._metrics = metrics
+        self._lock = threading.Lock()
+        self._graphs: dict[str, "hnswlib.Index"] = {}
+        self._locks: dict[str, _GraphLocks] = {}
+        self._deleted: dict[str, set[int]] = {}  # marked deleted, still in the graph
+        self._dirty: set[str] = set()
+        self._synced_id = 0
+
+    def _file(self, collection: str) -> Path:
+        return self.directory / (hashlib.sha256(collection.encode()).hexdigest()[:32] + ".bin")
+
+    def _collection_locks(self, collection: str) -> _GraphLocks:
+        with self._lock:
+            locks = self._locks.get(collection)
+            if locks is None:
+                locks = self._locks[collection] = _GraphLocks()
+            return locks
+
+    def _installed(self, collection: str, graph) -> None:
+        """Make a new or loaded graph searchable. Holds the lock."""
+        # Queries search with max(ef, k) candidates, so ef only needs setting once
+        graph.set_ef(self.ef_search)
+        self._graphs[collection] = graph
+        self._deleted.setdefault(collection, set())
+
+    def _graph(self, collection: str, capacity: int):
+        """The collection's graph, created or grown to hold capacity elements.
+        Holds the collection's adding lock."""
+        with self._lock:
+            graph = self._graphs.get(collection)
+        if graph is None:
+            graph = self._hnswlib.Index(space="l2", dim=self.dims)
+            graph.init_index(max_elements=max(capacity, 1024), ef_construction=self.ef_construction, M=self.m)
+            with self._lock:
+                self._installed(collection, graph)
+        elif capacity > graph.get_max_elements():
+            with self._collection_locks(collection).graph.write():
+                graph.resize_index(max(capacity, 2 * graph.get_max_elements()))
+        return graph
+
+    def add(self, collection: str, rows: Rows) -> None:
+        if not rows:
+            return
+        ids = np.array([id for id, _ in rows], dtype=np.int64)
+        vectors = np.array([embedding for _, embedding in rows], dtype=np.float32)
+        locks = self._collection_locks(collection)
+        with locks.adding:
+            with self._lock:
+                graph = self._graphs.get(collection)
+            graph = self._graph(collection, (graph.element_count if graph is not None else 0) + len(ids))
+            # Searches carry on while the items go in
+            with locks.graph.read():
+                # Re-adding an id replaces its vector, and undeletes it
+                graph.add_items(vectors, ids)
+            with self._lock:
+                self._deleted[collection].difference_update(ids.tolist())
+                self._dirty.add(collection)
+                self._synced_id = max(self._synced_id, int(ids.max()))
+
+    def remove(self, collection: str, ids: list[int]) -> None:
+        with self._lock:
+            graph = self._graphs.get(collection)
+        if graph is None:
+            return
+        locks = self._collection_locks(collection)
+        with locks.adding, locks.graph.write(), self._lock:
+            for id in ids:
+                if id in self._deleted[collection]:
+                    continue
+                try:
+                    graph.mark_deleted(id)
+                except RuntimeError:
+                    continue  # not in the graph
+                self._deleted[collection].add(id)
+            self._dirty.add(collection)
+
+    def nearest(
+        self, db: sqlite3.Connection, collection: str, embedding: list[float], k: int
+    ) -> list[tuple[int, float]] | None:
+        with self._lock:
+            graph = self._graphs.get(collection)
+        if graph is None:
+            return []
+        with self._collection_locks(collection).graph.read():
+            with self._lock:
+                k = min(k, self._live(collection))
+            if not k:
+                return []
+            labels, distances = graph.knn_query(np.asarray(embedding, dtype=np.float32), k=k)
+        # hnswlib's l2 space reports squared distances
+        return list(zip(labels[0].tolist(), np.sqrt(distances[0]).tolist()))
+
+    def distances(
+        self, db: sqlite3.Connection, collection: str, embedding: list[float], ids: list[int]
+    ) -> list[tuple[int, float]]:
+        with self._lock:
+            graph = self._graphs.get(collection)
+        vectors = None
+        if graph is not None and ids:
+            with self._collection_locks(collection).graph.read():
+                try:
+                    vectors = graph.get_items(ids)
+                except RuntimeError:
+                    pass  # some id isn't in the graph
+        if vectors is None:
+            return super().distances(db, collection, embedding, ids)
+        distances = np.linalg.norm(np.asarray(vectors) - np.asarray(embedding, dtype=np.float32), axis=1)
+        order = np.argsort(distances, kind="stable")
+        return [(ids[i], float(distances[i])) for i in order]
+
+    def _live(self, collection: str) -> int:
+        """Holds the lock."""
+        return self._graphs[collection].element_count - len(self._deleted[collection])
+
+    def sync(self, db: sqlite3.Connection, batch_size: int = 1000) -> int:
+        """Load the saved graphs, then add the memory_vecs rows they're missing."""
+        self._load()
+        cursor = db.execute(
+            "SELECT rowid, collection, embedding FROM memory_vecs WHERE rowid > ?", [self._synced_id]
+        )
+        added = 0
+        while rows := cursor.fetchmany(batch_size):
+            by_collection: dict[str, Rows] = {}
+            for id, collection, blob in rows:
+                by_collection.setdefault(collection, []).append((id, np.frombuffer(blob, dtype=np.float32)))
+            for collection, collection_rows in by_collection.items():
+                self.add(collection, collection_rows)
+            added += len(rows)
+
+        # Saves with smaller ids can commit after the last persist() covered a
+        # larger one; a count mismatch finds the collections that missed some
+        for collection, vector_count in db.execute("SELECT name, vector_count FROM collections"):
+            if (self._live(collection) if collection in self._graphs else 0) != vector_count:
+                added += self._reconcile(db, collection)
+        if added:
+            self.persist()
+        return added
+
+    def _reconcile(self, db: sqlite3.Connection, collection: str) -> int:
+        rows = db.execute(
+            "SELECT rowid, embedding FROM memory_vecs WHERE collection = ?", [collection]
+        ).fetchall()
+        stored = {id for id, _ in rows}
+        with self._lock:
+            graph = self._graphs.get(collection)
+        indexed = set()
+        if graph is not None:
+            with self._collection_locks(collection).graph.read():
+                ids = graph.get_ids_list()
+            with self._lock:
+                indexed = set(ids) - self._deleted[collection]
+        missing = [(id, np.frombuffer(blob, dtype=np.float32)) for id, blob in rows if id not in indexed]
+        self.add(collection, missing)
+        self.remove(collection, list(indexed - stored))
+        return len(missing)
+
+    def _load(self) -> None:
+        manifest_path = self.directory / "manifest.json"
+        if not manifest_path.exists():
+            return
+        manifest = json.loads(manifest_path.read_text())
+        with self._lock:
+            for collection, deleted in manifest["deleted"].items():
+                path = self._file(collection)
+                if not path.exists():
+                    continue
+                graph = self._hnswlib.Index(space="l2", dim=self.dims)
+                graph.load_index(str(path))
+                self._deleted[collection] = set(deleted)
+                self._installed(collection, graph)
+            self._synced_id = manifest["synced_id"]
+        log.info("Loaded %d HNSW graphs from %s", len(self._graphs), self.directory)
+
+    def persist(self) -> None:
+        """Save changed graphs, then the manifest, each replacing the old file atomically."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Taken before the graphs are saved, so the files cover at least what
+        # the manifest says; anything newer is added again by the next sync()
+        with self._lock:
+            dirty = [(collection, self._graphs[collection]) for collection in self._dirty]
+            self._dirty.clear()
+            manifest = {
+                "synced_id": self._synced_id,
+                "deleted": {collection: sorted(ids) for collection, ids in self._deleted.items()},
+            }
+        for collection, graph in dirty:
+            path = self._file(collection)
+            with self._collection_locks(collection).graph.write():
+                graph.save_index(str(path) + ".tmp")
+            os.replace(str(path) + ".tmp", path)
+        tmp = self.directory / "manifest.json.tmp"
+        tmp.write_text(json.dumps(manifest))
+        os.replace(tmp, self.directory / "manifest.json")